@@ -4,6 +4,7 @@ import pickle
 import plotly.express as px
 from our_codebases_check import get_all_clusters_files, contributors_per_microservice
 import json
+from scipy import sparse
 from scipy.cluster import hierarchy
 import numpy as np
 from mazlami_check import get_total_authors_count
@@ -12,12 +13,15 @@ from efficient_collector import get_couplings
 
 
 def build_similarity_matrix(logical_coupling):
-    # https://stackoverflow.com/questions/48393259/count-unique-pairs-and-store-counts-in-a-matrix
-    unique_filenames = list(logical_coupling['first_file'].unique())
-    v = pd.crosstab(logical_coupling['first_file'], logical_coupling['second_file'])
-    res = v.reindex(index=unique_filenames, columns=unique_filenames, fill_value=0)
-    np.fill_diagonal(res.values, 1)
-    return res
+    # Pairs are accumulated into a sparse co-change matrix, instead of cross-tabulating the pair list.
+    unique_filenames = pd.Index(logical_coupling['first_file'].unique())
+    first = unique_filenames.get_indexer(logical_coupling['first_file'])
+    second = unique_filenames.get_indexer(logical_coupling['second_file'])
+    in_matrix = second >= 0
+    co_changes = sparse.coo_matrix((np.ones(in_matrix.sum(), dtype=np.int64), (first[in_matrix], second[in_matrix])),
+                                   shape=(len(unique_filenames), len(unique_filenames))).toarray()
+    np.fill_diagonal(co_changes, 1)
+    return pd.DataFrame(co_changes, index=unique_filenames, columns=unique_filenames)
 
 
 def generate_decomposition(matrix, n_clusters, method, history):
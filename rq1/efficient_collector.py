@@ -79,14 +79,18 @@ def compute_logical_coupling(fixed_history):
 def extract_entity_files(repo_name, fixed_history):
     results = []
     id_to_entity = None
+    # First full filename of each basename, so each entity is resolved with a lookup instead of a scan of the history
+    basename_index = {}
+    for filename in fixed_history['filename'].unique():
+        if filename.endswith(".java"):
+            basename_index.setdefault(os.path.splitext(os.path.basename(filename))[0], filename)
     with open(f"all-codebases-data/{repo_name}/{repo_name}_IDToEntity.json", "r") as f:
         id_to_entity = json.load(f)
         files_plain = list(id_to_entity.values())
         for filename in files_plain:
-            filename_long = list(
-                fixed_history.loc[fixed_history['filename'].str.contains("/" + filename + ".java")]['filename'].head(1))
-            if len(filename_long) > 0:
-                results.append(filename_long[0])
+            filename_long = basename_index.get(filename)
+            if filename_long is not None:
+                results.append(filename_long)
     return results, id_to_entity
 
 
@@ -111,10 +115,12 @@ def convert_logical_coupling_authors_to_json(logical_coupling, history, id_to_en
     f = list(entity_to_id.keys())
     f.sort()
     history_copy['filename_id'] = history_copy['filename'].apply(lambda x: get_filename_id(x, entity_to_id))
+    # Authors of every file (and file id) in a single aggregation each, instead of a mask per file
+    authors_by_filename = history_copy.groupby('filename')['author'].unique()
+    authors_by_filename_id = history_copy.groupby('filename_id')['author'].unique()
 
     for file in filenames:
-        file_authors = list(history_copy[history_copy['filename'] == file]['author'])
-        author_data[get_filename_id(file, entity_to_id)] = list(set(file_authors))
+        author_data[get_filename_id(file, entity_to_id)] = list(authors_by_filename[file])
         changed_with_this_file = logical_coupling.loc[logical_coupling['first_file'] == file]['second_file']
         for file2 in list(changed_with_this_file):
             logical_coupling_data[get_filename_id(file, entity_to_id)].append(int(get_filename_id(file2, entity_to_id)))
@@ -126,8 +132,7 @@ def convert_logical_coupling_authors_to_json(logical_coupling, history, id_to_en
         file_id = get_filename_id(file, entity_to_id)
         if file_id not in logical_coupling_data:
             logical_coupling_data[file_id] = []
-            file_authors = list(history_copy[history_copy['filename_id'] == file_id]['author'])
-            author_data[file_id] = list(set(file_authors))
+            author_data[file_id] = list(authors_by_filename_id.get(file_id, []))
 
     return logical_coupling_data, author_data
 
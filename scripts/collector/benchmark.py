@@ -0,0 +1,182 @@
+"""
+Benchmarks of the collector pipeline over synthetic repositories.
+
+Repositories are generated locally with `git fast-import`, from a few parameters: number of commits, files per commit,
+rename and delete rates and number of authors. Each step of the collection is timed on them, and the results are
+written to resources/benchmarks/collector_<revision>.csv, so runs of different revisions can be compared.
+
+Run with `python -m collector.benchmark` from the scripts folder.
+"""
+import json
+import os
+import random
+import subprocess
+import tempfile
+import time
+from dataclasses import dataclass, asdict, replace
+
+import pandas as pd
+from rich import print
+
+from collector.history import History
+from collector.repository import Repository
+from collector.service import get_logical_couplings, authors_to_json
+from helpers.constants import Constants
+
+
+@dataclass(frozen=True)
+class SyntheticRepository:
+    commits: int = 1000
+    files_per_commit: int = 5
+    rename_rate: float = 0.05
+    delete_rate: float = 0.03
+    authors: int = 10
+    # Chance of a commit being a refactor, with `refactor_files` files, which the cleanup discards
+    refactor_rate: float = 0.01
+    refactor_files: int = 150
+    entity_rate: float = 0.3
+    seed: int = 0
+
+    def fast_import_stream(self):
+        """
+        Commits of the repository, in the input format of `git fast-import`. Renamed files are also edited, so git
+        has to detect them by similarity. About one in ten changes is to a file that is not Java.
+        """
+        rng = random.Random(self.seed)
+        files, next_file = [], 0
+        timestamp = 1500000000
+        for commit in range(self.commits):
+            timestamp += rng.choice([60, 600, 3600, 7200, 86400])
+            author = f"author{rng.randrange(self.authors)}@example.com"
+            yield f"commit refs/heads/master\ncommitter Author <{author}> {timestamp} +0000\ndata 0\n"
+            refactor = rng.random() < self.refactor_rate
+            for _ in range(self.refactor_files if refactor else rng.randint(1, 2 * self.files_per_commit - 1)):
+                change = rng.random()
+                if files and change < self.delete_rate:
+                    yield f"D {files.pop(rng.randrange(len(files)))}\n"
+                    continue
+                if files and change < self.delete_rate + self.rename_rate:
+                    position = rng.randrange(len(files))
+                    previous_filename, filename = files[position], self.filename(next_file)
+                    files[position], next_file = filename, next_file + 1
+                    yield f"R {previous_filename} {filename}\n"
+                elif not files or rng.random() < 0.2:
+                    filename = self.filename(next_file, java=rng.random() >= 0.1)
+                    files.append(filename)
+                    next_file += 1
+                else:
+                    filename = rng.choice(files)
+                contents = "".join(f"    int field{line} = {line};\n" for line in range(20)) + f"// {commit}\n"
+                yield f"M 100644 inline {filename}\ndata {len(contents)}\n{contents}\n"
+
+    @staticmethod
+    def filename(number, java=True):
+        return f"src/main/java/package{number % 20}/Class{number}.java" if java else f"docs/file{number}.txt"
+
+    def generate(self, path):
+        subprocess.run(["git", "init", "--quiet", path], check=True)
+        process = subprocess.Popen(["git", "-C", path, "fast-import", "--quiet"], stdin=subprocess.PIPE,
+                                   encoding="utf-8")
+        for chunk in self.fast_import_stream():
+            process.stdin.write(chunk)
+        process.stdin.close()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+        return subprocess.check_output(["git", "-C", path, "rev-parse", "master"], encoding="utf-8").strip()
+
+    def write_entities(self, directory, codebase_name, history_df):
+        """
+        Writes the entity translation files of the codebase, picking a share of its Java classes as entities.
+        """
+        rng = random.Random(self.seed)
+        short_names = sorted({os.path.splitext(os.path.basename(filename))[0]
+                              for filename in history_df['filename'].unique() if filename.endswith(".java")})
+        entities = [short_name for short_name in short_names if rng.random() < self.entity_rate]
+        os.makedirs(f"{directory}/{codebase_name}", exist_ok=True)
+        with open(f"{directory}/{codebase_name}/{codebase_name}_IDToEntity.json", "w") as f:
+            json.dump({str(i + 1): entity for i, entity in enumerate(entities)}, f)
+        with open(f"{directory}/{codebase_name}/{codebase_name}_entityToID.json", "w") as f:
+            json.dump({entity: i + 1 for i, entity in enumerate(entities)}, f)
+
+
+def timed(timings, step, function, *args):
+    t0 = time.perf_counter()
+    result = function(*args)
+    timings.append((step, time.perf_counter() - t0))
+    return result
+
+
+def benchmark_repository(synthetic_repository, directory, cutoff_value=100) -> list:
+    """
+    Times each step of the collection of a synthetic repository, generated under `directory`.
+    Returns (step, seconds) pairs.
+    """
+    codebase_name = "synthetic"
+    Constants.codebases_root_directory = f"{directory}/codebases_cloned"
+    Constants.codebases_data_output_directory = f"{directory}/codebases_collection"
+    Constants.histories_directory = f"{directory}/histories"
+    repository_path = f"{Constants.codebases_root_directory}/{codebase_name}"
+    last_hash = synthetic_repository.generate(repository_path)
+
+    def get_no_refactors_copy(history):
+        # The view is materialized when the cleaned history is stored, which is part of the cost of the cleanup
+        no_refactors_history = history.get_no_refactors_copy(cutoff_value)
+        no_refactors_history.history_df
+        return no_refactors_history
+
+    timings = []
+    history = timed(timings, "History.__init__", History, codebase_name)
+    synthetic_repository.write_entities(Constants.codebases_data_output_directory, codebase_name, history.history_df)
+    timed(timings, "fix_renames", history.fix_renames)
+    timed(timings, "fix_deletes", history.fix_deletes)
+    history = timed(timings, "get_no_refactors_copy", get_no_refactors_copy, history)
+    repo = Repository(codebase_name, repository_path, last_hash)
+    repo.history = history
+    timed(timings, "get_logical_couplings", get_logical_couplings, history, repo)
+    timed(timings, "authors_to_json", authors_to_json, history, repo)
+    return timings
+
+
+def current_revision():
+    try:
+        return subprocess.check_output(["git", "-C", str(Constants.project_root), "rev-parse", "--short", "HEAD"],
+                                       encoding="utf-8", stderr=subprocess.DEVNULL).strip()
+    except subprocess.CalledProcessError:
+        return "unknown"
+
+
+def run_benchmarks(base=SyntheticRepository(), commits_steps=(1000, 5000, 20000), repetitions=3, output_path=None):
+    """
+    Benchmarks the collector on synthetic repositories like `base`, with each number of commits in `commits_steps`.
+    Each one is generated and timed `repetitions` times. Results have a row per repository, repetition and step,
+    with the repository parameters, and are written as csv to `output_path` (by default,
+    resources/benchmarks/collector_<revision>.csv). Returns them.
+    """
+    revision = current_revision()
+    output_path = output_path or f"{Constants.resources_directory}/benchmarks/collector_{revision}.csv"
+    directories = (Constants.codebases_root_directory, Constants.codebases_data_output_directory,
+                   Constants.histories_directory)
+    results = []
+    try:
+        for commits in commits_steps:
+            synthetic_repository = replace(base, commits=commits)
+            print(f":white_circle: {commits} commits")
+            for repetition in range(repetitions):
+                with tempfile.TemporaryDirectory() as directory:
+                    for step, seconds in benchmark_repository(synthetic_repository, directory):
+                        results.append({"revision": revision, **asdict(synthetic_repository),
+                                        "repetition": repetition, "step": step, "seconds": seconds})
+                        print(f"  :white_circle: {step}: {round(seconds, 3)} s")
+    finally:
+        Constants.codebases_root_directory, Constants.codebases_data_output_directory, \
+            Constants.histories_directory = directories
+
+    results_df = pd.DataFrame(results)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    results_df.to_csv(output_path, index=False)
+    print(f"[underline]Results written to {output_path}[/underline]")
+    return results_df
+
+
+if __name__ == "__main__":
+    run_benchmarks()
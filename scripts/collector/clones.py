@@ -0,0 +1,120 @@
+"""
+Clones and updates the repositories of the codebases, ahead of collection.
+
+Forks of the same project share most of their objects, so they are cloned with the first one of them as a reference:
+their clones borrow its objects through git alternates instead of storing copies of them.
+"""
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from git import Repo, GitCommandError
+from rich import print
+
+from collector.gitlog import clone_path
+from helpers.constants import Constants
+
+
+def project_name(url):
+    """
+    Name of the project a repository URL points to. Forks of a project keep its name, under a different owner.
+    """
+    return os.path.basename(url.rstrip("/")).removesuffix(".git").lower()
+
+
+def has_commit(repository_path, commit_hash):
+    try:
+        Repo(repository_path).git.cat_file("-e", f"{commit_hash}^{{commit}}")
+    except GitCommandError:
+        return False
+    return True
+
+
+def clone_codebase(codebase_name, url, last_hash, reference=None):
+    """
+    Clones a codebase to `clone_path(codebase_name)`, borrowing the objects of the clone at `reference`, if given.
+    """
+    path = clone_path(codebase_name)
+    os.makedirs(Constants.codebases_root_directory, exist_ok=True)
+    options = {"reference": reference} if reference is not None else {}
+    if Constants.history_only_clones:
+        # The history is read from commits and trees only, so there is nothing to check out. A blobless partial
+        # clone would not help: rename detection reads the blobs, which would then be fetched one at a time.
+        Repo.clone_from(url, path, bare=True, **options)
+    else:
+        Repo.clone_from(url, path, no_checkout=True, **options)
+    move_head(path, last_hash)
+    return path
+
+
+def move_head(repository_path, last_hash):
+    """
+    Points the HEAD of a clone at `last_hash`, so reading its history without a revision stops at that commit, like
+    in a working clone with `last_hash` checked out.
+    """
+    repo = Repo(repository_path)
+    if repo.bare:
+        repo.git.update_ref("--no-deref", "HEAD", last_hash)
+    else:
+        repo.git.checkout(last_hash)
+
+
+def update_codebase(codebase_name, url, last_hash, reference=None) -> str:
+    """
+    Makes sure the clone of a codebase has `last_hash`: clones it if there is no clone yet, and fetches it if the
+    clone does not have that commit. Returns what was done.
+    """
+    path = clone_path(codebase_name)
+    if not os.path.isdir(path):
+        clone_codebase(codebase_name, url, last_hash, reference)
+        return "cloned" if reference is None else f"cloned, sharing objects with {os.path.basename(reference)}"
+    if has_commit(path, last_hash):
+        status = "up to date"
+    else:
+        # Bare clones have no remote-tracking refs, so the branches are fetched explicitly
+        Repo(path).git.fetch("--quiet", "--tags", "origin", "+refs/heads/*:refs/remotes/origin/*")
+        if not has_commit(path, last_hash):
+            raise ValueError(f"{last_hash} was not found in {url}")
+        status = "fetched"
+    if Repo(path).head.commit.hexsha != last_hash:
+        move_head(path, last_hash)
+    return status
+
+
+def update_project(codebases) -> list:
+    """
+    Updates the codebases of a single project, in order. The first one to have a clone is the reference of the others.
+    """
+    results = []
+    reference = None
+    for codebase_name, url, last_hash in codebases:
+        try:
+            results.append((codebase_name, update_codebase(codebase_name, url, last_hash, reference), None))
+        except (GitCommandError, ValueError) as error:
+            results.append((codebase_name, None, error))
+        if reference is None and os.path.isdir(clone_path(codebase_name)):
+            reference = clone_path(codebase_name)
+    return results
+
+
+def update_codebases(codebases, workers=8) -> list:
+    """
+    Clones or updates the repositories of all the codebases, with up to `workers` projects at a time. Codebases that
+    failed are reported and left out of the returned names, but do not stop the others.
+    """
+    projects = defaultdict(list)
+    for codebase_data in codebases:
+        projects[project_name(codebase_data[1])].append(tuple(codebase_data[:3]))
+
+    print(f":white_circle: Updating {len(codebases)} repositories")
+    updated = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for results in executor.map(update_project, projects.values()):
+            for codebase_name, status, error in results:
+                if error is None:
+                    print(f"  :white_circle: {codebase_name}: {status}")
+                    updated.append(codebase_name)
+                else:
+                    print(f"  [red]{codebase_name}: update failed[/red]")
+                    print(error)
+    return updated
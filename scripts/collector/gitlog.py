@@ -0,0 +1,255 @@
+"""
+Streaming reader for the history of a git repository.
+
+`git log --name-status` is consumed line by line, and only the changes to files with the requested extension are kept.
+The history columns are built directly while parsing, so the log is never written to disk nor parsed twice.
+"""
+import os
+import subprocess
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from rich import print
+
+from helpers.constants import Constants
+
+HISTORY_COLUMNS = ['commit_hash', 'change_type', 'previous_filename', 'filename', 'timestamp', 'author']
+
+CHANGE_TYPES = {
+    "A": "ADDED",
+    "M": "MODIFIED",
+    "D": "DELETED",
+}
+
+# Value of previous_filename for changes that are not renames
+NO_PREVIOUS_FILENAME = " "
+
+
+def log_command(repository_path, revisions=None, reverse=True, pathspecs=None):
+    # The rename limit is passed for this invocation only, so the repository configuration is never touched.
+    return ["git", "-C", str(repository_path), "-c", "diff.renameLimit=999999",
+            "log", *(["--reverse"] if reverse else []), "--name-status",
+            "--pretty=format:commit%x09%H%x09%ct%x09%ce", "--find-renames", *(revisions or []),
+            "--", *(pathspecs or [])]
+
+
+def parse_log(lines, extension=".java"):
+    """
+    Parses the lines of `git log --name-status` (in the format given by `log_command`) into history columns.
+
+    Values are interned while parsing: every column but the timestamp is returned as a categorical, and both filename
+    columns share the same categories, so the history can be queried by integer codes.
+    """
+    commits, change_types, filenames, authors = {}, {}, {NO_PREVIOUS_FILENAME: 0}, {}
+    codes = {column: array("i") for column in HISTORY_COLUMNS if column != 'timestamp'}
+    timestamps = array("q")
+    commit = timestamp = author = None
+    for line in lines:
+        fields = line.rstrip("\n").split("\t")
+        status = fields[0]
+        if status == "commit":
+            commit = commits.setdefault(fields[1], len(commits))
+            timestamp = int(fields[2])
+            author = authors.setdefault(fields[3], len(authors))
+            continue
+        if status in CHANGE_TYPES:
+            change_type, previous_filename, filename = CHANGE_TYPES[status], NO_PREVIOUS_FILENAME, fields[1]
+            if not filename.endswith(extension):
+                continue
+        elif status[:1] == "R" and status[1:].isdigit():
+            change_type, previous_filename, filename = "RENAMED", fields[1], fields[2]
+            if not (filename.endswith(extension) or previous_filename.endswith(extension)):
+                continue
+        else:
+            continue
+        codes['commit_hash'].append(commit)
+        codes['change_type'].append(change_types.setdefault(change_type, len(change_types)))
+        codes['previous_filename'].append(filenames.setdefault(previous_filename, len(filenames)))
+        codes['filename'].append(filenames.setdefault(filename, len(filenames)))
+        timestamps.append(timestamp)
+        codes['author'].append(author)
+
+    categories = {
+        'commit_hash': commits,
+        'change_type': change_types,
+        'previous_filename': filenames,
+        'filename': filenames,
+        'author': authors,
+    }
+    return {
+        column: np.frombuffer(timestamps, dtype=np.int64) if column == 'timestamp' else
+        pd.Categorical.from_codes(np.frombuffer(codes[column], dtype=np.int32), list(categories[column]))
+        for column in HISTORY_COLUMNS
+    }
+
+
+def intern_history(history_df) -> pd.DataFrame:
+    """
+    Makes sure the history columns are categoricals, with the filename columns sharing their categories.
+    """
+    interned = {}
+    for column in ['commit_hash', 'change_type', 'author']:
+        if not isinstance(history_df[column].dtype, pd.CategoricalDtype):
+            interned[column] = history_df[column].astype("category")
+    previous_filenames, filenames = history_df['previous_filename'], history_df['filename']
+    if not (isinstance(previous_filenames.dtype, pd.CategoricalDtype) and
+            isinstance(filenames.dtype, pd.CategoricalDtype) and
+            previous_filenames.cat.categories.equals(filenames.cat.categories)):
+        shared = union_categoricals([pd.Categorical(previous_filenames), pd.Categorical(filenames)]).categories
+        interned['previous_filename'] = pd.Categorical(previous_filenames, categories=shared)
+        interned['filename'] = pd.Categorical(filenames, categories=shared)
+    if not interned:
+        return history_df
+    return history_df.assign(**interned)
+
+
+def concat_columns(chunks):
+    """
+    Concatenates history columns parsed by `parse_log`, in order. The filename columns keep sharing their categories.
+    """
+    # Empty chunks are left out, as their categories have no dtype to match the others
+    chunks = [chunk for chunk in chunks if len(chunk['timestamp'])] or chunks[:1]
+    columns = {}
+    for column in ['commit_hash', 'change_type', 'author']:
+        columns[column] = union_categoricals([chunk[column] for chunk in chunks])
+    filenames = union_categoricals([chunk[column] for chunk in chunks for column in ['previous_filename', 'filename']])
+    for column in ['previous_filename', 'filename']:
+        columns[column] = pd.Categorical(union_categoricals([chunk[column] for chunk in chunks]),
+                                         categories=filenames.categories)
+    columns['timestamp'] = np.concatenate([chunk['timestamp'] for chunk in chunks])
+    return {column: columns[column] for column in HISTORY_COLUMNS}
+
+
+def run_log(command, extension, commits=None):
+    """
+    Runs a `git log` command and parses its output. `commits`, if given, are written to its standard input.
+    """
+    process = subprocess.Popen(command, stdin=subprocess.PIPE if commits is not None else None,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8", errors="replace")
+    if commits is not None:
+        # git reads all of its input before logging anything, so it can be written at once
+        process.stdin.write("".join(f"{commit}\n" for commit in commits))
+        process.stdin.close()
+    columns = parse_log(process.stdout, extension)
+    error = process.stderr.read()
+    if process.wait() != 0:
+        print("Error retrieving history.")
+        print(error)
+        raise subprocess.CalledProcessError(process.returncode, process.args, stderr=error)
+    return columns
+
+
+def rev_list(repository_path, revisions=None):
+    """
+    Hashes of the commits `git log --reverse` goes through for `revisions`, in the same order.
+    """
+    return subprocess.check_output(["git", "-C", str(repository_path), "rev-list", "--reverse", *(revisions or ["HEAD"]),
+                                    "--"], encoding="utf-8").split()
+
+
+def count_files(repository_path, extension=".java", revisions=None):
+    """
+    Hashes of the commits `git log --reverse` goes through for `revisions`, in the same order, and a lower bound of the
+    number of rows each of them has in the history. Renames are not looked for, so the files with the extension each
+    commit changes are counted with their deletions and additions, and at most one of those is dropped per rename.
+    """
+    command = ["git", "-C", str(repository_path), "log", "--reverse", "--name-status", "--no-renames",
+               "--pretty=format:commit%x09%H", *(revisions or []), "--"]
+    commits, file_counts, deletions, additions = [], array("q"), array("q"), array("q")
+    with subprocess.Popen(command, stdout=subprocess.PIPE, encoding="utf-8", errors="replace") as process:
+        for line in process.stdout:
+            status, _, filename = line.rstrip("\n").partition("\t")
+            if status == "commit":
+                commits.append(filename)
+                file_counts.append(0)
+                deletions.append(0)
+                additions.append(0)
+            elif filename.endswith(extension) and commits:
+                file_counts[-1] += 1
+                if status == "D":
+                    deletions[-1] += 1
+                elif status == "A":
+                    additions[-1] += 1
+    if process.returncode != 0:
+        print("Error retrieving history.")
+        raise subprocess.CalledProcessError(process.returncode, command)
+    file_counts, deletions, additions = (np.frombuffer(counts, dtype=np.int64)
+                                         for counts in (file_counts, deletions, additions))
+    return commits, file_counts - np.minimum(deletions, additions)
+
+
+def log_commits(repository_path, commits, extension=".java", shards=1, pathspecs=None):
+    """
+    Reads the log of exactly the given commits, in the order they are given. With `shards`, they are split into up to
+    that many contiguous ranges of at least `Constants.min_commits_per_shard` commits, each read by a git process of
+    its own, and put back together in order.
+    """
+    if not commits:
+        return parse_log([], extension)
+    command = log_command(repository_path, ["--stdin", "--no-walk=unsorted"], reverse=False, pathspecs=pathspecs)
+    shards = max(1, min(shards, len(commits) // Constants.min_commits_per_shard))
+    bounds = np.linspace(0, len(commits), shards + 1).astype(int)
+    with ThreadPoolExecutor(max_workers=shards) as executor:
+        chunks = list(executor.map(lambda start, end: run_log(command, extension, commits[start:end]),
+                                   bounds[:-1], bounds[1:]))
+    return concat_columns(chunks)
+
+
+def read_history(repository_path, extension=".java", revisions=None, shards=1, large_commit_files=None) -> pd.DataFrame:
+    """
+    Reads the history of the repository at `repository_path`, oldest commit first.
+
+    With `shards`, the log is read by up to that many git processes at once (see `log_commits`). The history is the
+    same as a serial read.
+
+    With `large_commit_files`, the files changed by each commit are counted first (see `count_files`), and commits
+    certain to have at least that many rows, which the cleanup discards as refactors, are read with renames looked for
+    among the files with the extension only. A file that changes extension in one of them shows up as a deletion and
+    an addition, and, with fewer candidates, git may pair the other renames of those commits differently. The renames
+    are carried back to earlier commits by the cleanup, so the cleaned history is only the same as the one of a full
+    read when the renames of large commits are unambiguous.
+    """
+    if large_commit_files is None:
+        commits = rev_list(repository_path, revisions) if shards > 1 else []
+        if len(commits) < 2 * Constants.min_commits_per_shard:
+            return pd.DataFrame(run_log(log_command(repository_path, revisions), extension))
+        return pd.DataFrame(log_commits(repository_path, commits, extension, shards))
+
+    commits, min_rows = count_files(repository_path, extension, revisions)
+    commits = np.array(commits, dtype=object)
+    large = min_rows >= large_commit_files
+    columns = concat_columns([
+        log_commits(repository_path, list(commits[~large]), extension, shards),
+        log_commits(repository_path, list(commits[large]), extension, shards, pathspecs=[f"*{extension}"]),
+    ])
+    # Both parts are in commit order, so a stable sort by commit position puts them back together
+    commit_positions = pd.Series(np.arange(len(commits)), index=commits)
+    row_positions = commit_positions.reindex(columns['commit_hash'].categories).to_numpy()[columns['commit_hash'].codes]
+    order = np.argsort(row_positions, kind="stable")
+    return pd.DataFrame({column: values[order] for column, values in columns.items()})
+
+
+def resolve_commit(repository_path, revision):
+    return subprocess.check_output(["git", "-C", str(repository_path), "rev-parse", f"{revision}^{{commit}}"],
+                                   encoding="utf-8").strip()
+
+
+def is_ancestor(repository_path, ancestor, descendant):
+    result = subprocess.run(["git", "-C", str(repository_path), "merge-base", "--is-ancestor", ancestor, descendant],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+
+def clone_path(codebase_name):
+    """
+    Local clone of a codebase: its bare mirror, `<name>.git`, when there is one, otherwise its working clone, `<name>`.
+    Codebases not cloned yet get a bare mirror, unless `Constants.history_only_clones` is turned off.
+    """
+    mirror = f"{Constants.codebases_root_directory}/{codebase_name}.git"
+    working_clone = f"{Constants.codebases_root_directory}/{codebase_name}"
+    if os.path.isdir(mirror) or (Constants.history_only_clones and not os.path.isdir(working_clone)):
+        return mirror
+    return working_clone
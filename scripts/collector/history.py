@@ -1,88 +1,257 @@
 from __future__ import annotations
 
 import json
+import os
+from dataclasses import dataclass
 from functools import cached_property
 
+import numpy as np
 import pandas as pd
-import subprocess
-from io import StringIO
-from rich import print
 
-from helpers.constants import Constants
+from collector.gitlog import read_history, intern_history, clone_path
+
+
+def resolve_renames(renames):
+    """
+    Resolves a chronological sequence of (before, after) renames into a mapping from each filename to its final name.
+
+    The result is the same as rewriting, rename by rename, every filename currently equal to `before` into `after`:
+    chains (A -> B -> C) end up in their last name, and a name that is reused after being renamed away starts over.
+    """
+    # Filenames grouped by their current name. The smaller group is always the one copied, like a union by size.
+    groups = {}
+    seen = set()
+    for before, after in renames:
+        for name in (before, after):
+            if name not in seen:
+                seen.add(name)
+                groups.setdefault(name, []).append(name)
+        if before == after:
+            continue
+        moved = groups.pop(before, None)
+        if moved is None:
+            continue
+        target = groups.get(after)
+        if target is None:
+            groups[after] = moved
+        elif len(target) < len(moved):
+            moved.extend(target)
+            groups[after] = moved
+        else:
+            target.extend(moved)
+
+    return {name: final_name for final_name, names in groups.items() for name in names if name != final_name}
+
+
+@dataclass(frozen=True)
+class CommitIndex:
+    """
+    The rows of a history grouped by commit, in compressed sparse row layout: the rows of the i-th commit are
+    `rows[offsets[i]:offsets[i + 1]]`, and `filenames` and `authors` hold the codes of their columns in that same order.
+    """
+    commit_hashes: np.ndarray
+    offsets: np.ndarray
+    rows: np.ndarray
+    filenames: np.ndarray
+    authors: np.ndarray
+
+    def __len__(self):
+        return len(self.commit_hashes)
 
 
 class History:
-    def __init__(self, codebase_name, df=None):
+    """
+    History of a codebase. Copies made by filtering it (`get_no_refactors_copy`, `get_entities_only_copy`) are views:
+    they share the frame of the history they come from, and only keep a mask of its rows. Readers take the columns
+    they need with `column`, and a view is only materialized when its whole `history_df` is used, to be stored.
+    """
+
+    def __init__(self, codebase_name, df=None, mask=None, revision=None, extension=".java"):
         if df is not None:
-            self.history_df = df
+            self.history_df = intern_history(df)
             self.codebase_name = codebase_name
         else:
-            command = f"{Constants.project_root}/collector/commit_log_script.sh {Constants.codebases_root_directory}/{codebase_name}/ | grep '\\.java'"
-            try:
-                output = subprocess.check_output(command, stderr=subprocess.STDOUT, shell=True, universal_newlines=True)
-                self.history_df = pd.read_csv(StringIO(output), sep=";", names=[
-                    'commit_hash', 'change_type', 'previous_filename', 'filename', 'timestamp', 'author'])
-                self.codebase_name = codebase_name
-            except subprocess.CalledProcessError as e:
-                print("Error retrieving history.")
-                print(e.output)
-        self.initial_number_of_commits = len(self.history_df["commit_hash"].unique())
+            self.history_df = read_history(clone_path(codebase_name), extension,
+                                           revisions=[revision] if revision else None)
+            self.codebase_name = codebase_name
+        self.extension = extension
+        self._mask = mask
+        self.initial_number_of_commits = int(np.count_nonzero(self.commit_sizes))
+
+    @property
+    def history_df(self):
+        if self._mask is not None:
+            self._base_df, self._mask = self._base_df.loc[self._mask], None
+        return self._base_df
+
+    @history_df.setter
+    def history_df(self, history_df):
+        self._base_df = history_df
+        self._mask = None
+        # Indexes derived from the history are rebuilt on their next use
+        self._columns = {}
+        self._basename_index = None
+        self._commit_sizes = None
+        self._commit_index = None
+
+    def column(self, name) -> pd.Series:
+        """
+        A column of the history, over the rows of this view. Only that column is copied, and the view is kept.
+        """
+        if name not in self._columns:
+            column = self._base_df[name]
+            self._columns[name] = column if self._mask is None else column[self._mask]
+        return self._columns[name]
+
+    @property
+    def commit_sizes(self):
+        """
+        Number of rows of each commit, indexed by the codes of the commit_hash column.
+        """
+        if self._commit_sizes is None:
+            commit_hashes = self._base_df['commit_hash'].cat
+            codes = commit_hashes.codes.to_numpy()
+            if self._mask is not None:
+                codes = codes[self._mask]
+            self._commit_sizes = np.bincount(codes, minlength=len(commit_hashes.categories))
+        return self._commit_sizes
+
+    def view(self, mask) -> History:
+        """
+        A history with the rows of this one for which `mask`, a boolean array over the rows of its frame, is set.
+        """
+        if self._mask is not None:
+            mask = self._mask & mask
+        return History(self.codebase_name, self._base_df, mask, extension=self.extension)
+
+    @property
+    def basename_index(self):
+        """
+        Maps each short filename (the basename, without extension) to the first full filename with it in the history.
+        Only filenames with the collected extension are indexed: after `fix_renames`, rows can also hold the other
+        name of a file renamed to or from that extension.
+        """
+        if self._basename_index is None:
+            self._basename_index = {}
+            for filename in self.column('filename').unique():
+                if filename.endswith(self.extension):
+                    self._basename_index.setdefault(os.path.splitext(os.path.basename(filename))[0], filename)
+        return self._basename_index
 
     def fix_renames(self) -> History:
-        rename_info = self.history_df.loc[self.history_df['change_type'] == "RENAMED"]
-        i = 0
-        for before, after in zip(rename_info['previous_filename'], rename_info['filename']):
-            i += 1
-            self.history_df.loc[self.history_df['filename'] == before, 'filename'] = after
+        filenames = self.history_df['filename'].cat
+        renamed = (self.history_df['change_type'] == "RENAMED").to_numpy()
+        final_names = resolve_renames(zip(self.history_df['previous_filename'].cat.codes.to_numpy()[renamed],
+                                          filenames.codes.to_numpy()[renamed]))
+
+        # Both filename columns share their categories, so renames are resolved over codes.
+        final_codes = np.arange(len(filenames.categories), dtype=np.int32)
+        final_codes[list(final_names.keys())] = list(final_names.values())
+        self.history_df = self.history_df.assign(
+            filename=pd.Categorical.from_codes(final_codes[filenames.codes.to_numpy()], filenames.categories)
+        )
         return self
 
     def fix_deletes(self) -> History:
-        delete_info = self.history_df.loc[self.history_df['change_type'] == "DELETED"]['filename']
-
         # Sometimes, files are deleted at timestamp X, but then appear as added or modified in timestamp X + Y.
         # The cause is unknown, but if this happens, we don't want to delete those files: there is relevant
         # information after their supposed "deletion", and they still exist in the current snapshot of the repo.
-        actual_files_to_delete = self.history_df.loc[self.history_df['filename'].isin(delete_info)] \
-            .groupby('filename') \
-            .filter(lambda x: x.tail(1)['change_type'] == 'DELETED')
+        # So only the files whose last change is a delete are removed.
+        last_changes = self.history_df.drop_duplicates('filename', keep='last')
+        actual_files_to_delete = last_changes.loc[last_changes['change_type'] == 'DELETED', 'filename']
 
-        self.history_df = self.history_df.loc[~self.history_df['filename'].isin(actual_files_to_delete['filename'])]
-        self.history_df = self.history_df.loc[~self.history_df['previous_filename'].isin(actual_files_to_delete['filename'])]
+        self.history_df = self.history_df.loc[~(self.history_df['filename'].isin(actual_files_to_delete) |
+                                                self.history_df['previous_filename'].isin(actual_files_to_delete))]
 
         return self
 
     def get_no_refactors_copy(self, cutoff_value):
-        no_refactors_df = self.history_df.groupby('commit_hash').filter(lambda x: len(x) < cutoff_value)
-        return History(self.codebase_name, no_refactors_df)
+        commit_codes = self._base_df['commit_hash'].cat.codes.to_numpy()
+        return self.view(self.commit_sizes[commit_codes] < cutoff_value)
 
     def get_entities_only_copy(self, entities_full_names):
-        entities_only_df = self.history_df.loc[self.history_df['filename'].isin(entities_full_names)]
-        return History(self.codebase_name, entities_only_df)
+        filenames = self._base_df['filename'].cat
+        entity_codes = filenames.categories.get_indexer(list(entities_full_names))
+        is_entity = np.zeros(len(filenames.categories), dtype=bool)
+        is_entity[entity_codes[entity_codes >= 0]] = True
+        return self.view(is_entity[filenames.codes.to_numpy()])
 
     def convert_short_to_long_filename(self, short):
-        match = list(
-            self.history_df.loc[self.history_df['filename'].str.contains("/" + short + ".java")]['filename'].head(1)
-        )
-        if len(match) == 0:
-            return None
-        else:
-            return match[0]
+        return self.basename_index.get(short)
 
     @property
     def first_ts(self):
-        return self.history_df['timestamp'].min()
+        return self.column('timestamp').min()
 
     @property
     def last_ts(self):
-        return self.history_df['timestamp'].max()
+        return self.column('timestamp').max()
+
+    def get_rows_in_windows(self, interval):
+        """
+        Yields the positions of the rows in each non-empty window of `interval` seconds, for the same windows as
+        `range(first_ts, last_ts, interval)`. Timestamps are bucketed once, so empty windows are never visited.
+        """
+        for _, rows in self.get_rows_in_windows_for_intervals([interval]):
+            yield rows
 
-    def get_filenames_in_range(self, bot, top):
-        range_ = self.history_df.loc[(self.history_df['timestamp'] < top) & (self.history_df['timestamp'] >= bot)]
-        return range_['filename']
+    def get_rows_in_windows_for_intervals(self, intervals):
+        """
+        Yields (interval, rows) for each non-empty window of each of the intervals, smallest interval first.
 
-    def get_file_authors(self, file):
-        return list(self.history_df[self.history_df['filename'] == file]['author'])
+        Rows are sorted by timestamp once for all intervals. When an interval is a multiple of a smaller one, its
+        windows are derived from the windows of the smaller one instead of from the timestamps.
+        """
+        timestamps = self.column('timestamp').to_numpy()
+        if len(timestamps) == 0:
+            return
+        order = np.argsort(timestamps, kind="stable")
+        offsets = timestamps[order] - timestamps.min()
+        windows_by_interval = {}
+        for interval in sorted(set(intervals)):
+            nested_in = next((smaller for smaller in sorted(windows_by_interval, reverse=True)
+                              if interval % smaller == 0), None)
+            if nested_in is None:
+                windows = offsets // interval
+            else:
+                windows = windows_by_interval[nested_in] // (interval // nested_in)
+            windows_by_interval[interval] = windows
+
+            # Windows starting at last_ts or later are not part of the range, as before.
+            in_range = windows < -(-offsets[-1] // interval)
+            window_starts = np.flatnonzero(np.diff(windows[in_range], prepend=-1))
+            for rows in np.split(order[in_range], window_starts[1:]):
+                if len(rows) > 0:
+                    yield interval, rows
+
+    @property
+    def commit_index(self) -> CommitIndex:
+        if self._commit_index is None:
+            commit_hashes = self.column('commit_hash').cat
+            codes = commit_hashes.codes.to_numpy()
+            # Commits are ordered by their first row, not by their codes: the order of the categories depends on
+            # whether the history was parsed at once or appended to a stored one.
+            present, first_rows = np.unique(codes, return_index=True)
+            order = present[np.argsort(first_rows)]
+            positions = np.empty(len(commit_hashes.categories), dtype=np.int64)
+            positions[order] = np.arange(len(order))
+            rows = np.argsort(positions[codes], kind="stable")
+            self._commit_index = CommitIndex(
+                commit_hashes=commit_hashes.categories.to_numpy()[order],
+                offsets=np.concatenate([[0], np.cumsum(self.commit_sizes[order])]),
+                rows=rows,
+                filenames=self.column('filename').cat.codes.to_numpy()[rows].astype(np.int32),
+                authors=self.column('author').cat.codes.to_numpy()[rows].astype(np.int32),
+            )
+        return self._commit_index
 
-    def commits(self):
-        for name, group in self.history_df.groupby('commit_hash'):
-            yield name, group
+    def commits(self, file_ids=None):
+        """
+        Yields (commit_hash, files) for each commit, in the order they first appear in the history. `files` is a slice
+        of the codes of the changed filenames or, if `file_ids` is given, of its values: an array with a value per row.
+        """
+        index = self.commit_index
+        files = index.filenames if file_ids is None else np.asarray(file_ids, dtype=np.int32)[index.rows]
+        offsets = index.offsets.tolist()
+        for i, commit_hash in enumerate(index.commit_hashes):
+            yield commit_hash, files[offsets[i]:offsets[i + 1]]
@@ -0,0 +1,103 @@
+import json
+import os
+
+import pandas as pd
+
+from collector.gitlog import read_history, resolve_commit, is_ancestor, intern_history
+from helpers.constants import Constants
+
+
+class HistoryStore:
+    """
+    Persistent, columnar store of the history of a codebase, kept under `Constants.histories_directory`.
+
+    The raw history is keyed by the commit it was read up to. When the requested commit descends from the stored one,
+    only the new range of commits is read and appended. Cleaned histories are keyed by that same commit and the
+    cleanup parameters, so they are only recomputed when one of them changes.
+    """
+
+    def __init__(self, codebase_name, repository_path, extension=".java"):
+        self.codebase_name = codebase_name
+        self.repository_path = repository_path
+        self.extension = extension
+        self.directory = f"{Constants.histories_directory}/{codebase_name}"
+
+    @property
+    def metadata_path(self):
+        return f"{self.directory}/history.json"
+
+    @property
+    def raw_history_path(self):
+        return f"{self.directory}/history.parquet"
+
+    def cleaned_history_path(self, cutoff_value):
+        return f"{self.directory}/history_cleaned_{cutoff_value}.parquet"
+
+    def read_metadata(self):
+        try:
+            with open(self.metadata_path, "r") as f:
+                metadata = json.load(f)
+        except FileNotFoundError:
+            return {}
+        if metadata.get("extension") != self.extension:
+            return {}
+        return metadata
+
+    def write_metadata(self, metadata):
+        with open(self.metadata_path, "w") as f:
+            json.dump({**metadata, "extension": self.extension}, f)
+
+    def load(self, revision, large_commit_files=None):
+        """
+        Returns the commit `revision` resolves to, and the raw history of the repository up to it. With
+        `large_commit_files`, the history is read in two passes (see `read_history`), and a history stored with another
+        value is read again.
+        """
+        head = resolve_commit(self.repository_path, revision)
+        metadata = self.read_metadata()
+        if metadata.get("large_commit_files") != large_commit_files:
+            metadata = {}
+        stored_head = metadata.get("head")
+        if stored_head == head and os.path.isfile(self.raw_history_path):
+            return head, pd.read_parquet(self.raw_history_path)
+
+        if stored_head is not None and os.path.isfile(self.raw_history_path) and \
+                is_ancestor(self.repository_path, stored_head, head):
+            new_history = read_history(self.repository_path, self.extension, [f"{stored_head}..{head}"],
+                                       Constants.history_shards, large_commit_files)
+            history_df = intern_history(pd.concat([pd.read_parquet(self.raw_history_path), new_history],
+                                                  ignore_index=True))
+        else:
+            history_df = read_history(self.repository_path, self.extension, [head], Constants.history_shards,
+                                      large_commit_files)
+
+        os.makedirs(self.directory, exist_ok=True)
+        history_df.to_parquet(self.raw_history_path, index=False)
+        # Cleaned histories of the previous head are left on disk, but no longer match the metadata.
+        self.write_metadata({"head": head, "large_commit_files": large_commit_files, "cleaned": {}})
+        return head, history_df
+
+    @staticmethod
+    def cleaned_key(head, large_commit_files):
+        # The read mode changes the cleaned history (see `read_history`), so it is part of the key
+        return {"head": head, "large_commit_files": large_commit_files}
+
+    def load_cleaned(self, head, cutoff_value, large_commit_files=None):
+        """
+        The cleaned history stored for `cutoff_value`, if it was cleaned from the history up to `head`, read with
+        `large_commit_files`. None otherwise.
+        """
+        stored_key = self.read_metadata().get("cleaned", {}).get(str(cutoff_value))
+        if stored_key != self.cleaned_key(head, large_commit_files):
+            return None
+        try:
+            return pd.read_parquet(self.cleaned_history_path(cutoff_value))
+        except FileNotFoundError:
+            return None
+
+    def save_cleaned(self, head, cutoff_value, history_df, large_commit_files=None):
+        os.makedirs(self.directory, exist_ok=True)
+        history_df.to_parquet(self.cleaned_history_path(cutoff_value), index=False)
+        metadata = self.read_metadata()
+        metadata.setdefault("cleaned", {})[str(cutoff_value)] = self.cleaned_key(head, large_commit_files)
+        self.write_metadata(metadata)
@@ -36,10 +36,8 @@ class Functionality:
     def __repr__(self):
         return self.__str__()
 
-    def get_entities_in_commit(self, commit, codebase_repo):
-        files = commit.commit_data["filename"]
-        files_ids = set([int(codebase_repo.get_file_id(file)) for file in list(files)])
-        return self.entities_ids_accessed.intersection(files_ids)
+    def get_entities_in_commit(self, commit):
+        return self.entities_ids_accessed.intersection(commit.commit_data.tolist())
 
 
 class Commit:
@@ -65,9 +63,10 @@ def parse_functionalities(static_analysis_file_path):
     return functionalities
 
 
-def get_commits_from_history(history):
+def get_commits_from_history(history, codebase_repo):
     commits = []
-    for commit_hash, commit_data in history.commits():
+    file_ids = codebase_repo.get_file_ids(history.column('filename'))
+    for commit_hash, commit_data in history.commits(file_ids):
         commits.append(Commit(commit_hash, commit_data))
     return commits
 
@@ -86,12 +85,12 @@ def increment_hash(commit_hash, hash_hash_table):
     return new_value
 
 
-def get_adapted_history(functionalities, commits, codebase_repo):
+def get_adapted_history(functionalities, commits):
     new_commit_list: [Commit] = []
     hash_hash_table = {}
     for functionality in functionalities:
         for commit in commits:
-            entities_from_functionality_in_commit = functionality.get_entities_in_commit(commit, codebase_repo)
+            entities_from_functionality_in_commit = functionality.get_entities_in_commit(commit)
             if len(entities_from_functionality_in_commit) > 1:
                 new_commit_list.append(Commit(
                     increment_hash(commit.commit_hash, hash_hash_table),
@@ -142,9 +141,9 @@ def collect(codebases):
         print("Parsing functionalities")
         functionalities = parse_functionalities(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}.json")
         print("Getting commit objects")
-        commits = get_commits_from_history(history)
+        commits = get_commits_from_history(history, codebase_repo)
         print("Converting history")
-        adapted_history = get_adapted_history(functionalities, commits, codebase_repo)
+        adapted_history = get_adapted_history(functionalities, commits)
         print("Getting couplings")
         couplings = get_couplings(adapted_history)
         print("Converting to json")
@@ -9,13 +9,15 @@ The algorithm is like so:
     * Cluster those entities in the best way possible (according to scipy's fcluster method)
     * Create a new functionality for each of the generated clusters
 """
+import os
 from collections import Counter
 from dataclasses import dataclass, field
 from functools import lru_cache
 
 from collector.repository import Repository
-from collector.service import get_logical_couplings
+from collector.service import get_logical_couplings, load_coupling_matrix
 from helpers.constants import Constants
+from helpers.traces import load_traces
 import json
 from scipy.cluster import hierarchy
 import numpy as np
@@ -82,9 +84,7 @@ class StaticFunctionality:
                 if entity1 == entity2:
                     entity1_similarity.append(1)
                 else:
-                    entity1_similarity.append(
-                        len(couplings.loc[(couplings["first_file"] == entity1) & (couplings["second_file"] == entity2)])
-                    )
+                    entity1_similarity.append(couplings[entity1, entity2])
             similarities.append(entity1_similarity)
         matrix = np.array(similarities)
         hierarc = hierarchy.linkage(y=matrix)
@@ -161,16 +161,9 @@ class StaticFunctionality:
         return {"t": [{"id": 0, "a": self.accesses}]}
 
 
-def convert_names_ids(element, repo):
-    return [int(repo.get_file_id(element[0])), int(repo.get_file_id(element[1]))]
-
-
 def parse_full_functionalities(static_analysis_file_path):
     functionalities = []
-    with open(static_analysis_file_path, "r") as f:
-        data = json.load(f)
-    for controller in data:
-        accesses = data[controller]["t"][0]["a"]
+    for controller, accesses in load_traces(static_analysis_file_path).items():
         functionalities.append(StaticFunctionality(accesses, controller))
     return functionalities
 
@@ -189,18 +182,18 @@ def collect(codebases):
         functionalities = parse_full_functionalities(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}.json")
 
         print("  :white_circle: Getting coupling data")
-        couplings = get_logical_couplings(history)
-
-        print("  :white_circle: Converting to ids")
-        couplings_ids = couplings.apply(convert_names_ids, args=[codebase_repo], axis=1, result_type='expand')
-        couplings_ids.set_axis(["first_file", "second_file"], axis=1, inplace=True)
+        if os.path.isfile(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_commit.npz"):
+            couplings = load_coupling_matrix(codebase)
+        else:
+            couplings = get_logical_couplings(history, codebase_repo)
+        couplings = couplings.todok()
 
         print("  :white_circle: Splitting functionalities")
         final_data_collection = {}
         id_to_entity = codebase_repo.id_to_entity
         data_analysis = DataAnalysis()
         for functionality in functionalities:
-            for new_functionality in functionality.split(couplings_ids, id_to_entity, data_analysis, print_actions=True, show_graph=False):
+            for new_functionality in functionality.split(couplings, id_to_entity, data_analysis, print_actions=True, show_graph=False):
                 final_data_collection[new_functionality.name] = new_functionality.json_format()
 
         print(f"{len(functionalities)} functionalities were split into {len(final_data_collection)} "
@@ -11,7 +11,6 @@ Script to identify subtraces of functionalities using commit logs.
          If it isn't, and list A is not empty, add the list to the dictionary
 4. Return top 10 most common subtraces
 """
-import os
 from collections import Counter, defaultdict
 
 from collector.legacy.functionalitysplit import parse_full_functionalities
@@ -62,16 +61,17 @@ def main():
         f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}.json")
 
     entity_to_id = codebase_repo.entity_to_id
+    file_ids = codebase_repo.get_file_ids(history.column('filename'))
 
     for functionality in functionalities:
         print(f"    :white_circle: {functionality.name}")
         entities_in_functionality = set()
         for a in functionality.accesses:
             entities_in_functionality.add(a[1])
-        for commit_hash, commit_data in history.commits():
+        for commit_hash, commit_data in history.commits(file_ids):
             new_subtrace = Subtrace([], functionality.name)
             trace_with_commit_entities = False
-            commit_data_ids = [int(codebase_repo.file_to_id[os.path.splitext(os.path.basename(f))[0]]) for f in commit_data["filename"]]
+            commit_data_ids = set(commit_data.tolist())
             for access in functionality.accesses:
                 if access[1] in commit_data_ids:
                     if trace_with_commit_entities:
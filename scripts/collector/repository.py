@@ -1,13 +1,74 @@
 import json
 import os
-from functools import cached_property
-from git import Repo
+from dataclasses import dataclass
 
+import numpy as np
+import pandas as pd
+
+from collector.clones import clone_codebase
+from collector.gitlog import clone_path, resolve_commit
 from collector.history import History
+from collector.history_store import HistoryStore
 from helpers.constants import Constants
 from rich import print
 
 
+@dataclass(frozen=True)
+class EntityMaps:
+    id_to_entity: dict
+    entity_to_id: dict
+    entity_ids: frozenset
+    entity_short_names: frozenset
+
+
+def short_filename(full_filename):
+    return os.path.splitext(os.path.basename(full_filename))[0]
+
+
+class FileRegistry:
+    """
+    Persistent ids of the files of a codebase, by short filename. Entities keep the id of the static analysis, other
+    files get the next free id the first time they are seen, and keep it across collections.
+    """
+
+    def __init__(self, path, entity_to_id):
+        self.path = path
+        try:
+            with open(path, "r") as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            stored = {}
+        entity_ids = {int(entity_id) for entity_id in entity_to_id.values()}
+        # Files whose id was since given to an entity are registered again, with a new id
+        self.file_to_id = {short_name: int(file_id) for short_name, file_id in stored.items()
+                           if short_name not in entity_to_id and int(file_id) not in entity_ids}
+        self.file_to_id.update({short_name: int(entity_id) for short_name, entity_id in entity_to_id.items()})
+        self.next_id = max(self.file_to_id.values(), default=0) + 1
+        self.changed = self.file_to_id != stored
+
+    def assign(self, short_names):
+        """
+        Returns the ids of the short filenames, registering the ones that have none yet.
+        """
+        ids = []
+        for short_name in short_names:
+            file_id = self.file_to_id.get(short_name)
+            if file_id is None:
+                file_id = self.file_to_id[short_name] = self.next_id
+                self.next_id += 1
+                self.changed = True
+            ids.append(file_id)
+        if self.changed:
+            self.save()
+        return ids
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w") as f:
+            json.dump(self.file_to_id, f)
+        self.changed = False
+
+
 class Repository:
     """
     Represents a repository. Allows for access to history and information of files, as well as clone.
@@ -17,35 +78,72 @@ class Repository:
         self.name = codebase_name
         self.url = url
         self.last_hash = last_hash
+        self._entity_maps = None
+        # The file maps depend on the entity maps, and are kept with the ones they were built from
+        self._file_registry = None
+        self._file_maps = None
         self.clone()
-        self.history = History(codebase_name)
+        self.history_store = HistoryStore(codebase_name, self.path)
+        self.head = resolve_commit(self.path, last_hash)
+        # The raw history is read on first use, or by `cleanup_history`, which knows which commits it will discard
+        self._history = None
+        self._large_commit_files = None
         self.no_refactors_history = None
 
+    @property
+    def path(self):
+        return clone_path(self.name)
+
     def clone(self):
-        if not os.path.isdir(Constants.codebases_root_directory):
-            os.mkdir(Constants.codebases_root_directory)
-        if os.path.isdir(f"{Constants.codebases_root_directory}/{self.name}"):
+        if os.path.isdir(self.path):
             return
-        print(f"  :white_circle: Cloning {self.name} to {Constants.codebases_root_directory}/{self.name}")
-        repo = Repo.clone_from(self.url, f"{Constants.codebases_root_directory}/{self.name}", no_checkout=True)
-        repo.git.checkout(self.last_hash)
+        print(f"  :white_circle: Cloning {self.name} to {self.path}")
+        clone_codebase(self.name, self.url, self.last_hash)
         print("       :white_circle: Done")
 
 
+    @property
+    def history(self) -> History:
+        if self._history is None:
+            self.load_history()
+        return self._history
+
+    @history.setter
+    def history(self, history):
+        self._history = history
+
+    def load_history(self, large_commit_files=None):
+        self.head, history_df = self.history_store.load(self.head, large_commit_files)
+        self._history = History(self.name, history_df)
+        self._large_commit_files = large_commit_files
+
     def cleanup_history(self, cutoff_value) -> History:
-        self.history = self.history.fix_renames().fix_deletes()
-        self.no_refactors_history = self.history.get_no_refactors_copy(cutoff_value)
+        # A raw history that was already read is cleaned as it is, whatever mode it was read with
+        if self._history is None:
+            large_commit_files = cutoff_value if Constants.two_pass_history else None
+        else:
+            large_commit_files = self._large_commit_files
+        cleaned_df = self.history_store.load_cleaned(self.head, cutoff_value, large_commit_files)
+        if cleaned_df is not None:
+            self.no_refactors_history = History(self.name, cleaned_df)
+        else:
+            if self._history is None:
+                self.load_history(large_commit_files)
+            self.history = self.history.fix_renames().fix_deletes()
+            self.no_refactors_history = self.history.get_no_refactors_copy(cutoff_value)
+            self.history_store.save_cleaned(self.head, cutoff_value, self.no_refactors_history.history_df,
+                                            large_commit_files)
         self.history = self.no_refactors_history
         return self.no_refactors_history
 
     @property
     def unique_filenames(self):
         # Abstraction could be better here
-        return list(self.history.history_df['filename'].unique())
+        return list(self.history.column('filename').unique())
 
     @property
     def entity_short_names(self):
-        return self.id_to_entity.values()
+        return self.entity_maps.entity_short_names
 
     @property
     def entity_full_names(self):
@@ -57,47 +155,93 @@ class Repository:
                 long_entities.append(filename_long)
         return long_entities
 
-    def get_file_id(self, full_filename):
-        return self.file_to_id[os.path.splitext(os.path.basename(full_filename))[0]]
+    def get_file_ids(self, filenames):
+        """
+        Ids of a column of (categorical) filenames, looked up once per distinct filename. Files without an id are
+        registered in order of appearance.
+        """
+        if not isinstance(filenames.dtype, pd.CategoricalDtype):
+            filenames = filenames.astype("category")
+        codes = filenames.cat.codes.to_numpy()
+        categories = filenames.cat.categories
+        used_codes = pd.unique(codes)
+        category_ids = np.full(len(categories), -1, dtype=np.int32)
+        category_ids[used_codes] = self.file_registry.assign([short_filename(categories[code]) for code in used_codes])
+        return category_ids[codes]
+
+    @property
+    def file_registry(self) -> FileRegistry:
+        """
+        The file ids of the codebase. Built again when the entity maps are read again, as entities keep their ids.
+        """
+        entity_maps = self.entity_maps
+        if self._file_registry is None or self._file_registry[0] is not entity_maps:
+            self._file_registry = (entity_maps, FileRegistry(
+                f"{Constants.codebases_data_output_directory}/{self.name}/{self.name}_fileToID.json",
+                entity_maps.entity_to_id))
+        return self._file_registry[1]
 
-    @cached_property
+    @property
     def id_to_file(self):
-        id_to_entity = self.id_to_entity
-        entity_to_id = self.entity_to_id
-        last_id = int(list(id_to_entity.keys())[-1])
-        ids_filename = {}
-
-        for file in self.unique_filenames:
-            short_name = os.path.splitext(os.path.basename(file))[0]
-            if short_name in list(id_to_entity.values()):
-                ids_filename[str(entity_to_id[short_name])] = short_name
-            else:
-                last_id += 1
-                ids_filename[str(last_id)] = short_name
-        return ids_filename
-
-    @cached_property
+        return self.file_maps[0]
+
+    @property
     def file_to_id(self):
-        return {v: k for k, v in self.id_to_file.items()}
+        return self.file_maps[1]
+
+    @property
+    def file_maps(self):
+        """
+        The (id_to_file, file_to_id) maps of the files in the history, built again when the history or the file
+        registry change.
+        """
+        file_registry, history = self.file_registry, self.history
+        if self._file_maps is None or self._file_maps[0] is not file_registry or self._file_maps[1] is not history:
+            short_names = list(dict.fromkeys(short_filename(file) for file in self.unique_filenames))
+            id_to_file = {str(file_id): short_name
+                          for short_name, file_id in zip(short_names, file_registry.assign(short_names))}
+            self._file_maps = (file_registry, history, (id_to_file, {v: k for k, v in id_to_file.items()}))
+        return self._file_maps[2]
 
     @property
     def id_to_entity(self):
-        try:
-            with open(f"{Constants.codebases_data_output_directory}/{self.name}/{self.name}_IDToEntity"
-                      f".json", "r") as f:
-                return json.load(f)
-        except FileNotFoundError as e:
-            print(f"[red]The [b]IDToEntity.json[/b] file could not be found at "
-                  f"{Constants.codebases_data_output_directory}/{self.name}/{self.name}_IDToEntity.json.[/red]")
-            raise e
+        return self.entity_maps.id_to_entity
 
     @property
     def entity_to_id(self):
+        return self.entity_maps.entity_to_id
+
+    @property
+    def entity_ids(self):
+        return self.entity_maps.entity_ids
+
+    @property
+    def entity_maps(self) -> EntityMaps:
+        """
+        The entity translation maps of the codebase. They are read once, and only read again when one of the files
+        is modified.
+        """
+        id_to_entity_path = f"{Constants.codebases_data_output_directory}/{self.name}/{self.name}_IDToEntity.json"
+        entity_to_id_path = f"{Constants.codebases_data_output_directory}/{self.name}/{self.name}_entityToID.json"
+        modification_times = (self.get_modification_time(id_to_entity_path, "IDToEntity.json"),
+                              self.get_modification_time(entity_to_id_path, "entityToID.json"))
+        if self._entity_maps is None or self._entity_maps[0] != modification_times:
+            with open(id_to_entity_path, "r") as f:
+                id_to_entity = json.load(f)
+            with open(entity_to_id_path, "r") as f:
+                entity_to_id = json.load(f)
+            self._entity_maps = (modification_times, EntityMaps(
+                id_to_entity=id_to_entity,
+                entity_to_id=entity_to_id,
+                entity_ids=frozenset(id_to_entity.keys()),
+                entity_short_names=frozenset(id_to_entity.values()),
+            ))
+        return self._entity_maps[1]
+
+    @staticmethod
+    def get_modification_time(path, description):
         try:
-            with open(f"{Constants.codebases_data_output_directory}/{self.name}/{self.name}_entityToID"
-                      f".json", "r") as f:
-                return json.load(f)
+            return os.stat(path).st_mtime_ns
         except FileNotFoundError as e:
-            print(f"[red]The [b]entityToID.json[/b] file could not be found at "
-                  f"{Constants.codebases_data_output_directory}/{self.name}/{self.name}_IDToEntity.json.[/red]")
+            print(f"[red]The [b]{description}[/b] file could not be found at {path}.[/red]")
             raise e
@@ -2,87 +2,155 @@ from __future__ import annotations
 
 import json
 import os
-import subprocess
+import sys
 import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
 from io import StringIO
 
+import numpy as np
 import pandas as pd
 from rich import print
+from scipy import sparse
 
-import itertools
-from collections import defaultdict
-
+from collector.clones import update_codebases
+from collector.gitlog import read_history, clone_path
 from collector.history import History
 from collector.repository import Repository
 from helpers.constants import Constants
 
 
-def findsubsets(s: set, m: int):
-    return set(itertools.permutations(s, m))
-
-
-def update_coupling(file, file_coupled, couplings):
-    if file in couplings:
-        if file_coupled in couplings[file]:
-            couplings[file][file_coupled] += 1
-        else:
-            couplings[file][file_coupled] = 1
-        couplings[file]["total_commits"] += 1
-    else:
-        couplings[file] = {
-            file_coupled: 1,
-            "total_commits": 1
-        }
-
-
-def get_logical_couplings(history: History, repo: Repository):
-    couplings = []
-    logical_coupling = {}
-    for bottom_range in range(history.first_ts, history.last_ts, Constants.group_commits_interval):
-        top_range = bottom_range + Constants.group_commits_interval
-        filenames = set(history.get_filenames_in_range(bottom_range, top_range))
-        if len(filenames) > 1:
-            for pair in findsubsets(filenames, 2):
-                update_coupling(str(repo.get_file_id(pair[0])), str(repo.get_file_id(pair[1])), logical_coupling)
-    return logical_coupling
+def get_logical_couplings(history: History, repo: Repository, interval=None) -> sparse.csr_matrix:
+    """
+    Builds the co-change matrix of the history: the entry of two file ids counts the windows of `interval` seconds
+    (by default, `Constants.group_commits_interval`) in which they changed together.
+    """
+    interval = interval or Constants.group_commits_interval
+    return get_logical_couplings_for_intervals(history, repo, [interval])[interval]
 
 
-def coupling_to_json(logical_coupling, repo: Repository) -> dict:
+def get_logical_couplings_for_intervals(history: History, repo: Repository, intervals) -> dict:
+    """
+    Builds one co-change matrix per interval, in a single pass over the history sorted by time and encoded as ids.
+    Each unordered pair of filenames is generated once per window, and the matrices are made symmetric at the end.
+    """
+    codes = history.column('filename').cat.codes.to_numpy()
+    file_ids = repo.get_file_ids(history.column('filename'))
+    pairs = {interval: ([], []) for interval in intervals}
+    for interval, rows in history.get_rows_in_windows_for_intervals(intervals):
+        _, first_rows = np.unique(codes[rows], return_index=True)
+        if len(first_rows) > 1:
+            window_ids = file_ids[rows[first_rows]]
+            first, second = np.triu_indices(len(window_ids), 1)
+            pairs[interval][0].append(window_ids[first])
+            pairs[interval][1].append(window_ids[second])
+
+    size = max(int(file_id) for file_id in [*repo.id_to_file.keys(), *repo.id_to_entity.keys()]) + 1
+    couplings = {}
+    for interval, (first_ids, second_ids) in pairs.items():
+        first_ids = np.concatenate(first_ids) if first_ids else np.empty(0, dtype=np.int32)
+        second_ids = np.concatenate(second_ids) if second_ids else np.empty(0, dtype=np.int32)
+        interval_pairs = sparse.coo_matrix((np.ones(len(first_ids), dtype=np.int32), (first_ids, second_ids)),
+                                           shape=(size, size))
+        # Filenames sharing an id are coupled with themselves, once in each order, like every other pair.
+        couplings[interval] = (interval_pairs + interval_pairs.T).tocsr()
+    return couplings
+
+
+def write_coupling_json(coupling_matrix, path):
     """
-    Organizes pairs that appear together, and stores the information in a dictionary ready to be saved as a
-    .json file.
+    Writes the co-change matrix in the format of the commit .json file: the number of times each file changed with
+    each of the others, and the total number of those co-changes. Rows are encoded and written one at a time,
+    straight from the matrix.
     """
+    coupling_matrix = coupling_matrix.tocsr()
+    coupling_matrix.sort_indices()
+    indptr, indices, data = coupling_matrix.indptr, coupling_matrix.indices, coupling_matrix.data
+    with open(path, "w") as f:
+        f.write("{")
+        separator = ""
+        for file_id in np.flatnonzero(np.diff(indptr)):
+            start, end = indptr[file_id], indptr[file_id + 1]
+            partners = "".join(f'"{partner_id}": {count}, '
+                               for partner_id, count in zip(indices[start:end].tolist(), data[start:end].tolist()))
+            f.write(f'{separator}"{file_id}": {{{partners}"total_commits": {int(data[start:end].sum())}}}')
+            separator = ", "
+        f.write("}")
+
+
+def write_expanded_coupling_json(coupling_matrix, path, file_ids=()):
+    """
+    Writes the co-change matrix in the legacy, expanded format: each file lists the files it changed with, once per
+    co-change. Files in `file_ids` are written even if they never changed with others.
+    """
+    coupling_matrix = coupling_matrix.tocsr()
+    coupling_matrix.sort_indices()
+    indptr, indices, data = coupling_matrix.indptr, coupling_matrix.indices, coupling_matrix.data
+    coupled_ids = np.flatnonzero(np.diff(indptr))
+    with open(path, "w") as f:
+        f.write("{")
+        separator = ""
+        for file_id in sorted({*coupled_ids.tolist(), *(int(file_id) for file_id in file_ids)}):
+            if file_id < len(indptr) - 1:
+                start, end = indptr[file_id], indptr[file_id + 1]
+                partners = ", ".join(map(str, np.repeat(indices[start:end], data[start:end]).tolist()))
+            else:
+                partners = ""
+            f.write(f'{separator}"{file_id}": [{partners}]')
+            separator = ", "
+        f.write("}")
+
+
+def export_expanded_coupling(codebase, suffix=""):
+    """
+    Exports the stored co-change matrix of a codebase in the expanded format, for tools that still expect it. Every
+    entity is listed, even the ones that never changed with others. Returns the path of the exported file.
+    """
+    codebase_directory = f"{Constants.codebases_data_output_directory}/{codebase}"
+    with open(f"{codebase_directory}/{codebase}_IDToEntity.json", "r") as f:
+        entity_ids = json.load(f).keys()
+    path = f"{codebase_directory}/{codebase}_commit{suffix}_expanded.json"
+    write_expanded_coupling_json(load_coupling_matrix(codebase, suffix), path, entity_ids)
+    return path
 
-    logical_coupling_data = defaultdict(list)
 
-    for file in repo.unique_filenames:
-        changed_with_this_file = logical_coupling.loc[logical_coupling['first_file'] == file]['second_file']
-        if len(list(changed_with_this_file)) == 0:
-            logical_coupling_data[str(repo.get_file_id(file))] = []
-        else:
-            for file2 in list(changed_with_this_file):
-                logical_coupling_data[str(repo.get_file_id(file))].append(int(repo.get_file_id(file2)))
+def load_coupling_matrix(codebase, suffix="") -> sparse.csr_matrix:
+    return sparse.load_npz(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_commit{suffix}.npz")
 
-    # Any entity that we missed for some reason? Also add it here. Otherwise, many tears will be shed 😭
-    for entity_id in list(repo.id_to_entity.keys()):
-        if entity_id not in logical_coupling_data:
-            logical_coupling_data[entity_id] = []
 
-    return logical_coupling_data
+def get_author_changes(history: History, repo: Repository) -> pd.Series:
+    """
+    Number of changes of each author to each file id, in a single grouped aggregation over file ids and author codes.
+    """
+    return pd.DataFrame({
+        'file_id': repo.get_file_ids(history.column('filename')),
+        'author': history.column('author').cat.codes.to_numpy(),
+    }).groupby(['file_id', 'author'], sort=False).size()
 
 
-def authors_to_json(history: History, repo: Repository):
+def authors_to_json(history: History, repo: Repository, author_changes=None):
+    if author_changes is None:
+        author_changes = get_author_changes(history, repo)
+    authors = history.column('author').cat.categories
     author_data = {}
-    for file in repo.unique_filenames:
-        file_authors = history.get_file_authors(file)
-        author_data[repo.get_file_id(file)] = list(set(file_authors))
+    for (file_id, author), _ in author_changes.items():
+        author_data.setdefault(str(file_id), []).append(authors[author])
     return author_data
 
 
+def author_changes_to_json(history: History, author_changes):
+    authors = history.column('author').cat.categories
+    author_changes_data = {}
+    for (file_id, author), changes in author_changes.items():
+        author_changes_data.setdefault(str(file_id), {})[authors[author]] = int(changes)
+    return author_changes_data
+
+
 def remove_non_entities_files(all_files_logical_coupling_json, codebase_repo):
     non_entities_coupling = {}
-    entities_ids = list(codebase_repo.id_to_entity.keys())
-    for entity_id in entities_ids:
+    entities_ids = codebase_repo.entity_ids
+    for entity_id in codebase_repo.id_to_entity:
         non_entities_coupling[entity_id] = all_files_logical_coupling_json[entity_id]
 
     for entity_id in non_entities_coupling:
@@ -91,60 +159,127 @@ def remove_non_entities_files(all_files_logical_coupling_json, codebase_repo):
     return non_entities_coupling
 
 
-def collect_data(codebases, force_recollection):
-    execution_times = []
-    for i, codebase_data in enumerate(codebases):
-        codebase = codebase_data[0]
-        codebase_url = codebase_data[1]
-        codebase_hash = codebase_data[2]
-        t0 = time.time()
-        print("")
-        print(f"[underline]{codebase}[/underline] [{i + 1}/{len(codebases)}]")
+def is_collected(codebase):
+    return os.path.isfile(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_commit.json")
 
-        if os.path.isfile(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_commit.json") and not force_recollection:
-            print(":white_circle: Data has been collected and recollection was not requested. Skipping.")
-            continue
 
-        print(":white_circle: Parsing history")
-        codebase_repo = Repository(codebase, codebase_url, codebase_hash)
-        cutoff_value = 100
-        history = codebase_repo.cleanup_history(cutoff_value)
+def collect_codebase(codebase_data, force_recollection, intervals=None, author_changes=False):
+    """
+    Collects the data of a single codebase. Returns its row of execution_times.csv, or None if it was skipped.
+    """
+    codebase = codebase_data[0]
+    codebase_url = codebase_data[1]
+    codebase_hash = codebase_data[2]
+    t0 = time.time()
+
+    if is_collected(codebase) and not force_recollection:
+        print(":white_circle: Data has been collected and recollection was not requested. Skipping.")
+        return None
+
+    print(":white_circle: Parsing history")
+    codebase_repo = Repository(codebase, codebase_url, codebase_hash)
+    cutoff_value = 100
+    history = codebase_repo.cleanup_history(cutoff_value)
+
+    print(":white_circle: Getting couplings data")
+    interval_couplings = get_logical_couplings_for_intervals(
+        history, codebase_repo, {Constants.group_commits_interval, *(intervals or [])})
+    all_files_logical_coupling = interval_couplings[Constants.group_commits_interval]
 
-        print(":white_circle: Getting couplings data")
-        all_files_logical_coupling = get_logical_couplings(history, codebase_repo)
+    print(":white_circle: Getting authors data")
+    all_files_author_changes = get_author_changes(history, codebase_repo)
+    all_files_authors = authors_to_json(history, codebase_repo, all_files_author_changes)
 
-        print(":white_circle: Getting authors data")
-        all_files_authors = authors_to_json(history, codebase_repo)
+    print(":white_circle: Writing")
+    write_jsons(all_files_logical_coupling, all_files_authors, codebase)
+    for interval in intervals or []:
+        write_coupling(interval_couplings[interval], codebase, f"_{interval}")
+    if author_changes:
+        with open(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_author_changes.json", "w") as f:
+            json.dump(author_changes_to_json(history, all_files_author_changes), f)
 
-        print(":white_circle: Writing")
-        write_jsons(all_files_logical_coupling, all_files_authors, codebase)
+    t1 = time.time()
+    print(f"[underline]Done in {round(t1-t0, 2)} seconds.[/underline]")
 
-        t1 = time.time()
-        print(f"[underline]Done in {round(t1-t0, 2)} seconds.[/underline]")
+    return [codebase, round(t1-t0, 2), history.initial_number_of_commits, os.getpid()]
+
+
+def collect_codebase_in_worker(codebase_data, force_recollection, intervals, author_changes):
+    """
+    Runs `collect_codebase` in a worker process. The output is kept and returned, so it can be printed in order, and
+    errors are returned instead of raised, so a failing codebase does not stop the others.
+    """
+    output = StringIO()
+    execution_time, error = None, None
+    with redirect_stdout(output):
+        try:
+            execution_time = collect_codebase(codebase_data, force_recollection, intervals, author_changes)
+        except Exception:
+            error = traceback.format_exc()
+    return output.getvalue(), execution_time, error
 
-        execution_times.append([codebase, round(t1-t0, 2), history.initial_number_of_commits])
-    execution_times_df = pd.DataFrame(execution_times, columns=["Codebase", "Time (s)", "# Initial Commits"])\
+
+def collect_data(codebases, force_recollection, intervals=None, workers=None, author_changes=False, clone_workers=8):
+    """
+    Collects the commit and author data of every codebase. If `intervals` is given, a co-change matrix is also
+    computed for each of them in the same pass, and written side by side as <codebase>_commit_<interval>.json.
+    With `author_changes`, the number of changes of each author to each file is written to
+    <codebase>_author_changes.json.
+
+    The repositories to collect are first cloned or updated, `clone_workers` at a time, and the ones that could not be
+    are skipped. With `workers`, codebases are collected in parallel by a pool of that many processes. Their output is still printed in the order of `codebases`.
+    """
+    to_update = [codebase_data for codebase_data in codebases
+                 if force_recollection or not is_collected(codebase_data[0])]
+    updated = set(update_codebases(to_update, clone_workers))
+    failed = {codebase_data[0] for codebase_data in to_update} - updated
+    if failed:
+        print(f"[yellow]Skipping {len(failed)} codebases that could not be updated: "
+              f"{', '.join(sorted(failed))}[/yellow]")
+    codebases = [codebase_data for codebase_data in codebases if codebase_data[0] not in failed]
+    execution_times = []
+    if workers is None:
+        for i, codebase_data in enumerate(codebases):
+            print("")
+            print(f"[underline]{codebase_data[0]}[/underline] [{i + 1}/{len(codebases)}]")
+            execution_time = collect_codebase(codebase_data, force_recollection, intervals, author_changes)
+            if execution_time is not None:
+                execution_times.append(execution_time)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(collect_codebase_in_worker, codebase_data, force_recollection, intervals,
+                                       author_changes)
+                       for codebase_data in codebases]
+            for i, (codebase_data, future) in enumerate(zip(codebases, futures)):
+                output, execution_time, error = future.result()
+                print("")
+                print(f"[underline]{codebase_data[0]}[/underline] [{i + 1}/{len(codebases)}]")
+                sys.stdout.write(output)
+                if error is not None:
+                    print("[red]Collection failed:[/red]")
+                    print(error)
+                elif execution_time is not None:
+                    execution_times.append(execution_time)
+    execution_times_df = pd.DataFrame(execution_times, columns=["Codebase", "Time (s)", "# Initial Commits", "Worker"])\
         .to_csv(f"{Constants.resources_directory}/execution_times.csv", index=False)
 
 
-def write_jsons(all_files_logical_coupling_json, all_files_authors_json, codebase):
-    with open(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_commit.json", "w") as f:
-        json.dump(all_files_logical_coupling_json, f)
+def write_jsons(all_files_logical_coupling, all_files_authors_json, codebase):
+    write_coupling(all_files_logical_coupling, codebase)
     with open(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_author.json", "w") as f:
         json.dump(all_files_authors_json, f)
 
 
+def write_coupling(coupling_matrix, codebase, suffix=""):
+    sparse.save_npz(f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_commit{suffix}.npz",
+                    coupling_matrix)
+    write_coupling_json(coupling_matrix, f"{Constants.codebases_data_output_directory}/{codebase}/{codebase}_commit{suffix}.json")
+
+
 def codebases_statistics(codebases):
     data = []
     for i, codebase_data in enumerate(codebases):
-        command = f"{Constants.project_root}/collector/commit_log_script.sh {Constants.codebases_root_directory}/{codebase_data[0]}"
-        try:
-            output = subprocess.check_output(command, stderr=subprocess.STDOUT, shell=True, universal_newlines=True)
-            history_df = pd.read_csv(StringIO(output), sep=";", names=[
-                'commit_hash', 'change_type', 'previous_filename', 'filename', 'timestamp', 'author'])
-        except subprocess.CalledProcessError as e:
-            print("Error retrieving history.")
-            print(e.output)
+        history_df = read_history(clone_path(codebase_data[0]), extension="", revisions=[codebase_data[2]])
         print(codebase_data[0])
         with open(f"{Constants.codebases_data_output_directory}/{codebase_data[0]}/{codebase_data[0]}_IDToEntity.json", "r") as e:
             data.append([codebase_data[0], len(history_df['commit_hash'].unique()), len(history_df['author'].unique()), len(json.load(e).keys())])
@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 from pathlib import Path
 
@@ -8,5 +9,13 @@ class Constants:
     project_root: Path = Path(__file__).parent.parent
     codebases_data_output_directory: str = str(project_root) + "/resources/codebases_collection"
     resources_directory: str = str(project_root) + "/resources"
+    histories_directory: str = str(project_root) + "/resources/histories"
     codebases_root_directory: str = str(project_root) + "/codebases_cloned"
+    history_only_clones: bool = True
+    history_shards: int = os.cpu_count() or 1
+    min_commits_per_shard: int = 5000
+    # Read commits too large to survive the cleanup with renames looked for among the collected files only. Faster on
+    # histories with large refactors, but git may pair renames differently in those commits, which changes the cleaned
+    # history, so it is off by default.
+    two_pass_history: bool = False
     mono2micro_codebases_root: str = str(project_root.parent) + "/mono2micro-mine/codebases"
@@ -19,12 +19,13 @@ def get_codebases_of_interest(codebases_root):
     for folder in os.listdir(codebases_root):
         if "_adapted" in folder:
             continue
-        if ".git" in os.listdir(f"{codebases_root}/{folder}"):
+        # Codebases are either bare mirrors, <codebase>.git, or working clones
+        if folder.endswith(".git") or ".git" in os.listdir(f"{codebases_root}/{folder}"):
             commit_count = get_commit_count(folder, codebases_root)
             author_count = get_author_count(folder, codebases_root)
             if commit_count >= 100 and author_count > 1:
                 # print(f"{folder} has {commit_count} commits and {author_count} authors")
-                results.append(folder)
+                results.append(folder.removesuffix(".git"))
 
     return results
 
@@ -0,0 +1,164 @@
+"""
+Columnar representation of the functionality traces of a static collection (datafile.json / <codebase>.json).
+
+The traces of all controllers are kept in three flat arrays: the accesses of the i-th controller are the entity ids and
+modes at `offsets[i]:offsets[i + 1]`. The arrays can be placed in shared memory, so a pool of processes can read the
+same traces without each one parsing or copying them.
+
+They are also stored on disk, next to the datafile they come from (datafile.json -> datafile.traces/), as one .npy file
+per array and a names.json with the controller names. `load_traces` memory-maps that store, converting the datafile
+first if there is no store yet or the datafile is newer.
+"""
+import json
+import os
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+MODES = ["R", "W"]
+
+ARRAY_DTYPES = {
+    "offsets": np.int64,
+    "entity_ids": np.int32,
+    "modes": np.uint8,
+}
+
+
+class Traces:
+    def __init__(self, names, offsets, entity_ids, modes):
+        self.names = list(names)
+        self.offsets = offsets
+        self.entity_ids = entity_ids
+        self.modes = modes
+        self.positions = {name: i for i, name in enumerate(self.names)}
+        self._shared_memory = []
+
+    @classmethod
+    def from_data_collection(cls, data_collection):
+        """
+        Converts the traces of a parsed datafile. Accesses in read mode get mode 0, every other access gets mode 1.
+        """
+        names, lengths, entity_ids, modes = [], [], [], []
+        for controller, trace in data_collection.items():
+            accesses = trace["t"][0]["a"]
+            names.append(controller)
+            lengths.append(len(accesses))
+            entity_ids.extend(access[1] for access in accesses)
+            modes.extend(access[0] != "R" for access in accesses)
+        return cls(names, np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]),
+                   np.array(entity_ids, dtype=np.int32), np.array(modes, dtype=np.uint8))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def accesses(self, name):
+        """
+        Accesses of a controller, as [mode, entity id] pairs like in the datafile.
+        """
+        i = self.positions[name]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return [[MODES[mode], entity_id]
+                for mode, entity_id in zip(self.modes[start:end].tolist(), self.entity_ids[start:end].tolist())]
+
+    def items(self):
+        for name in self.names:
+            yield name, self.accesses(name)
+
+    def to_dataframe(self):
+        """
+        One row per access, with the controller name, entity id and mode ("R" or "W").
+        """
+        return pd.DataFrame({
+            "name": np.repeat(np.array(self.names, dtype=object), np.diff(self.offsets)),
+            "entity_id": self.entity_ids,
+            "mode": np.array(MODES, dtype=object)[self.modes],
+        })
+
+    def arrays(self):
+        return {array: getattr(self, array) for array in ARRAY_DTYPES}
+
+    def share(self):
+        """
+        Copies the arrays to shared memory. Returns a description of them, to be given to `Traces.attach` in other
+        processes, and the shared memory blocks, which the caller has to close and unlink when done.
+        """
+        blocks, description = [], {"names": self.names, "arrays": {}}
+        for array, values in self.arrays().items():
+            block = SharedMemory(create=True, size=max(values.nbytes, 1))
+            np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[:] = values
+            blocks.append(block)
+            description["arrays"][array] = (block.name, len(values))
+        return description, blocks
+
+    @classmethod
+    def attach(cls, description):
+        """
+        Traces over the shared memory blocks described by `description`, read-only.
+        """
+        blocks, arrays = [], {}
+        for array, (block_name, length) in description["arrays"].items():
+            block = SharedMemory(name=block_name)
+            arrays[array] = np.ndarray((length,), dtype=ARRAY_DTYPES[array], buffer=block.buf)
+            arrays[array].flags.writeable = False
+            blocks.append(block)
+        traces = cls(description["names"], **arrays)
+        # The blocks stay open for as long as the arrays over them are in use
+        traces._shared_memory = blocks
+        return traces
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for array, values in self.arrays().items():
+            np.save(f"{directory}/{array}.npy", values)
+        # Written last: a store without names is incomplete
+        with open(f"{directory}/names.json", "w") as f:
+            json.dump(self.names, f)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Opens a store written by `save`. The arrays are memory-mapped, read-only, so pages are only read when used
+        and are shared by every process that opens the same store.
+        """
+        with open(f"{directory}/names.json", "r") as f:
+            names = json.load(f)
+        return cls(names, **{array: load_array(f"{directory}/{array}.npy") for array in ARRAY_DTYPES})
+
+
+def load_array(path):
+    try:
+        return np.load(path, mmap_mode="r")
+    except ValueError:
+        # Empty arrays cannot be memory-mapped
+        return np.load(path)
+
+
+def trace_store_path(datafile_path):
+    return os.path.splitext(datafile_path)[0] + ".traces"
+
+
+def convert_datafile(datafile_path):
+    """
+    Converts a datafile to a trace store, next to it. Returns the path of the store.
+    """
+    with open(datafile_path, "r") as f:
+        traces = Traces.from_data_collection(json.load(f))
+    store_path = trace_store_path(datafile_path)
+    traces.save(store_path)
+    return store_path
+
+
+def load_traces(datafile_path) -> Traces:
+    """
+    Traces of a datafile, memory-mapped from its trace store. The store is (re)built when missing or older than the
+    datafile.
+    """
+    store_path = trace_store_path(datafile_path)
+    names_path = f"{store_path}/names.json"
+    if not os.path.isfile(names_path) or os.path.getmtime(names_path) < os.path.getmtime(datafile_path):
+        convert_datafile(datafile_path)
+    return Traces.load(store_path)
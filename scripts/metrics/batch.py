@@ -0,0 +1,133 @@
+"""
+Evaluates every cut the analyser produced for a codebase, in a single run.
+
+The traces of the datafile are loaded once, from its trace store, and placed in shared memory, where a pool of
+processes reads them. Each cut (analyser/cuts/<access>,<write>,<read>,<sequence>,<commit>,<authors>,<n_clusters>.json)
+gets its complexity and, when the author data of the codebase is available, its team size reduction (TSR). Results
+are written as they come, one row per cut keyed by its weights, to <codebase>-cuts-metrics.csv in the codebases
+collection folder. Cuts that cannot be evaluated get a row with empty metrics and the error.
+
+Run with `python -m metrics.batch <Mono2Micro codebase> [--collection-codebase <codebase>]` from the scripts folder.
+"""
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+
+from rich import print
+
+from helpers.constants import Constants
+from helpers.traces import Traces, load_traces
+from metrics.complexity import init_decomposition, get_controllers_with_costly_accesses
+from metrics.tsr import contributors_per_microservice, get_total_authors_count
+
+WEIGHTS = ["access", "write", "read", "sequence", "commit", "authors", "n_clusters"]
+
+# Set in each worker by `init_worker`
+worker_traces = None
+worker_author_data = None
+
+
+def parse_weights(cut_filename):
+    return tuple(int(weight) for weight in cut_filename.replace(".json", "").split(","))
+
+
+def init_worker(traces_description, author_data):
+    global worker_traces, worker_author_data
+    worker_traces = Traces.attach(traces_description)
+    worker_author_data = author_data
+
+
+def evaluate_cut(cut_path, traces, author_data=None):
+    """
+    Computes the metrics of a single cut. The TSR is None if there is no author data. The number of clusters it is
+    averaged over is the one in the name of the cut, like in `tsr.get_tsr_data_for_clusters`.
+    """
+    with open(cut_path, "r") as f:
+        cut = json.load(f)
+    decomposition = init_decomposition(cut["clusters"])
+    decomposition.controllers, decomposition.accesses_controllers = get_controllers_with_costly_accesses(
+        None, decomposition.entity_id_to_cluster_id, traces)
+    complexity = decomposition.compute_complexity(traces)
+
+    tsr = None
+    if author_data:
+        n_clusters = parse_weights(os.path.basename(cut_path))[-1]
+        tsr = contributors_per_microservice(cut, author_data, n_clusters) / \
+              get_total_authors_count(author_data)
+    return complexity, tsr
+
+
+def evaluate_cut_in_worker(cut_path):
+    """
+    Runs `evaluate_cut` in a worker process. Returns (complexity, tsr, error): errors are returned instead of raised,
+    so a cut that cannot be evaluated does not stop the others.
+    """
+    # The metric functions print their durations, which would be interleaved across cuts
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        try:
+            return (*evaluate_cut(cut_path, worker_traces, worker_author_data), None)
+        except (Exception, SystemExit) as error:
+            return None, None, f"{type(error).__name__}: {error}"
+
+
+def evaluate_cuts(codebase_name, collection_codebase_name=None, workers=None, output_path=None):
+    """
+    Evaluates all cuts of a Mono2Micro codebase with a pool of `workers` processes. The author data is read from the
+    collection of `collection_codebase_name` (by default, the same name). Returns the path of the results.
+    """
+    codebase_path = f"{Constants.mono2micro_codebases_root}/{codebase_name}"
+    collection_codebase_name = collection_codebase_name or codebase_name
+    output_path = output_path or f"{Constants.codebases_data_output_directory}/{codebase_name}-cuts-metrics.csv"
+
+    print(f":white_circle: Loading the traces of {codebase_name}")
+    traces = load_traces(f"{codebase_path}/datafile.json")
+    author_path = f"{Constants.codebases_data_output_directory}/{collection_codebase_name}/" \
+                  f"{collection_codebase_name}_author.json"
+    author_data = None
+    if os.path.isfile(author_path):
+        with open(author_path, "r") as f:
+            author_data = json.load(f)
+    else:
+        print(f"  [yellow]No author data at {author_path}, TSR will not be computed[/yellow]")
+
+    cut_filenames = sorted(os.listdir(f"{codebase_path}/analyser/cuts"))
+    print(f":white_circle: Evaluating {len(cut_filenames)} cuts")
+    traces_description, blocks = traces.share()
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(traces_description, author_data)) as executor, \
+                open(output_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([*WEIGHTS, "complexity", "tsr", "error"])
+            futures = {executor.submit(evaluate_cut_in_worker, f"{codebase_path}/analyser/cuts/{cut_filename}"):
+                       cut_filename for cut_filename in cut_filenames}
+            failed = 0
+            for future in as_completed(futures):
+                complexity, tsr, error = future.result()
+                if error is not None:
+                    print(f"  [red]{futures[future]}: evaluation failed[/red]")
+                    print(f"    {error}")
+                    failed += 1
+                writer.writerow([*parse_weights(futures[future]), complexity, tsr, error])
+                f.flush()
+            if failed:
+                print(f"[yellow]{failed} of {len(cut_filenames)} cuts could not be evaluated[/yellow]")
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    print(f"[underline]Results written to {output_path}[/underline]")
+    return output_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluates every cut of a Mono2Micro codebase.")
+    parser.add_argument("codebase", help="name of the codebase in Mono2Micro, e.g. fenixedu-academic_all")
+    parser.add_argument("--collection-codebase", help="name of the codebase in the collection, for its author data")
+    parser.add_argument("--workers", type=int, help="number of processes (by default, one per CPU)")
+    parser.add_argument("--output", help="path of the results (by default, <codebase>-cuts-metrics.csv)")
+    arguments = parser.parse_args()
+    evaluate_cuts(arguments.codebase, arguments.collection_codebase, arguments.workers, arguments.output)
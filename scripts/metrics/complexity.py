@@ -1,30 +1,41 @@
 import json
 from collections import defaultdict
 
+import numpy as np
 import pandas as pd
 from funcy import print_durations
 
 from helpers.constants import Constants
+from helpers.traces import load_traces
 
 
 
 @print_durations
-def get_controllers_to_clusters(clusters, controllers):
-    result = defaultdict(set)
-    for cluster in clusters:
-        for controller in controllers:
-            for entity_id in controller.entities:
-                if entity_id in cluster.entities:
-                    result[controller].add(cluster)
-    return result
+def get_controllers_to_clusters(decomposition, controllers):
+    """
+    Returns the set of clusters each controller touches, and the number of those clusters, by controller.
+    """
+    controllers_clusters = {}
+    clusters_counts = {}
+    for controller in controllers:
+        entity_ids = np.fromiter(controller.entities.keys(), dtype=np.int64, count=len(controller.entities))
+        entity_ids = entity_ids[entity_ids < len(decomposition.entity_clusters)]
+        cluster_indexes = np.unique(decomposition.entity_clusters[entity_ids])
+        cluster_indexes = cluster_indexes[cluster_indexes >= 0]
+        controllers_clusters[controller] = {decomposition.clusters[i] for i in cluster_indexes}
+        clusters_counts[controller] = len(cluster_indexes)
+    return controllers_clusters, clusters_counts
 
 
 class Decomposition:
     def __init__(self):
         self.entity_id_to_cluster_id = {}
+        # Position in `clusters` of the cluster of each entity id, or -1
+        self.entity_clusters = np.empty(0, dtype=np.int32)
         self.clusters = []
         self.controllers = {}
         self.accesses_controllers = {}
+        self.costly_accesses_index = {}
 
     def add_cluster(self, cluster):
         self.clusters.append(cluster)
@@ -33,41 +44,49 @@ class Decomposition:
         self.entity_id_to_cluster_id[entity_id] = cluster_id
 
     @print_durations
-    def get_all_transactions_set(self, data_collection):
+    def get_all_transactions_set(self, traces):
         all_local_transactions_sets = {}
         for controller in self.controllers.keys():
-            local_transaction_set = self.get_local_transactions_set(controller, data_collection)
+            local_transaction_set = self.get_local_transactions_set(controller, traces)
             all_local_transactions_sets[controller] = local_transaction_set
             # print(f"{controller} has {len(local_transaction_set)} local transactions")
         return all_local_transactions_sets
 
-    def get_controller_complexity(self, controller_local_transactions, controller, controllers_clusters_map):
-        i = 0
-        controllers_touching_entity_with_mode_cache = {}
+    def get_controller_complexity(self, controller_local_transactions, controller):
         complexity = 0
         for local_transaction in controller_local_transactions:
-            i += 1
             controllers_touching_same_entities = set()
             for a in local_transaction.cluster_accesses:
-                controllers_that_touch_this_entity_and_mode = controllers_touching_entity_with_mode_cache.get(a, None)
-                if controllers_that_touch_this_entity_and_mode is None:
-                    controllers_that_touch_this_entity_and_mode = self.cost_of_access(controller, a,
-                                                                                      controllers_clusters_map)
-                    controllers_touching_entity_with_mode_cache[a] = controllers_that_touch_this_entity_and_mode
-                for c in controllers_that_touch_this_entity_and_mode:
-                    controllers_touching_same_entities.add(c)
+                controllers_touching_same_entities.update(self.costly_accesses_index.get((a[1], a[0]), ()))
+            controllers_touching_same_entities.discard(controller)
             complexity += len(controllers_touching_same_entities)
         return complexity
 
+    def index_costly_accesses(self, clusters_counts):
+        """
+        Maps each (entity id, mode) to the names of the controllers that add to the complexity of an access to that
+        entity with that mode: the ones that touch more than one cluster, and touch the entity with another mode.
+        """
+        index = defaultdict(set)
+        for controller in self.controllers.values():
+            if clusters_counts[controller] <= 1:
+                continue
+            for entity_id, saved_mode in controller.entities.items():
+                for mode in (0, 1):
+                    if saved_mode != mode:
+                        index[(entity_id, mode)].add(controller.name)
+        self.costly_accesses_index = {access: frozenset(controllers) for access, controllers in index.items()}
+
     @print_durations
-    def compute_complexity(self, data_collection):
+    def compute_complexity(self, traces):
         complexity = 0
-        all_local_transactions_sets = self.get_all_transactions_set(data_collection)
-        controllers_clusters_map = get_controllers_to_clusters(self.clusters, self.controllers.values())
+        all_local_transactions_sets = self.get_all_transactions_set(traces)
+        controllers_clusters_map, clusters_counts = get_controllers_to_clusters(self, self.controllers.values())
+        self.index_costly_accesses(clusters_counts)
         for controller in self.controllers.keys():
-            if len(controllers_clusters_map[self.controllers[controller]]) == 1:
+            if clusters_counts[self.controllers[controller]] == 1:
                 continue
-            complexity += self.get_controller_complexity(all_local_transactions_sets[controller], controller, controllers_clusters_map)
+            complexity += self.get_controller_complexity(all_local_transactions_sets[controller], controller)
 
             # for transaction in all_local_transactions_sets[controller]:
             #     # Find next local transactions, add cluster dependencies
@@ -75,8 +94,8 @@ class Decomposition:
         complexity /= len(controllers_clusters_map)
         return complexity
 
-    def get_local_transactions_set(self, controller, data_collection):
-        accesses = data_collection[controller]["t"][0]["a"]
+    def get_local_transactions_set(self, controller, traces):
+        accesses = traces.accesses(controller)
         first_accessed_cluster_id = None
         local_transaction_sequence = []
         entity_id_to_mode = {}
@@ -114,17 +133,6 @@ class Decomposition:
 
         return local_transaction_sequence
 
-    def cost_of_access(self, controller_name, a, controllers_clusters_map):
-        controllers_touching_this_entity_with_mode = []
-
-        # Working solution
-        for controller in self.controllers.values():
-            if controller.name != controller_name and controller in controllers_clusters_map:
-                saved_mode = controller.entities.get(a[1], None)
-                if saved_mode is not None and saved_mode != a[0] and len(controllers_clusters_map[controller]) > 1:
-                    controllers_touching_this_entity_with_mode.append(controller.name)
-        return controllers_touching_this_entity_with_mode
-
 
 class LocalTransaction:
     def __init__(self, cluster_id, new_cluster_access, first_accessed_entity_id):
@@ -175,11 +183,10 @@ def add_access_to_accesses_controllers(entity_id, mode, controller, accesses_con
 
 
 @print_durations()
-def get_controllers_with_costly_accesses(codebase_name, entity_id_to_cluster_id, data_collection):
+def get_controllers_with_costly_accesses(codebase_name, entity_id_to_cluster_id, traces):
     controllers = {}
     accesses_controllers = defaultdict(list)
-    for controller_name, trace in data_collection.items():
-        accesses = trace["t"][0]["a"]
+    for controller_name, accesses in traces.items():
         entity_id_to_mode = {}
         previous_cluster = '-2'
         controller = Controller(controller_name)
@@ -192,8 +199,7 @@ def get_controllers_with_costly_accesses(codebase_name, entity_id_to_cluster_id,
                 mode = 1
             cluster = entity_id_to_cluster_id.get(entity_id, None)
             if cluster is None:
-                print(f"Entity {entity_id} was not assigned to a cluster, abort.")
-                exit(0)
+                raise ValueError(f"Entity {entity_id} was not assigned to a cluster.")
             if i == 0:
                 entity_id_to_mode[entity_id] = mode
                 added_entity = controller.add_entity(entity_id, mode)
@@ -230,6 +236,10 @@ def init_decomposition(clusters):
         decomposition.add_cluster(Cluster(entities, cluster_id))
         for entity_id in entities:
             decomposition.add_entity(entity_id, cluster_id)
+    decomposition.entity_clusters = np.full(max(decomposition.entity_id_to_cluster_id, default=-1) + 1, -1,
+                                            dtype=np.int32)
+    for cluster_index, entities in enumerate(clusters.values()):
+        decomposition.entity_clusters[list(entities)] = cluster_index
     return decomposition
 
 
@@ -238,14 +248,13 @@ def build_decomposition():
     with open(f"{Constants.mono2micro_codebases_root}/fenixedu-academic_all/analyser/cuts/"
               f"20,10,0,10,60,0,5.json", "r") as f:
         clusters = json.load(f)["clusters"]
-    with open(f"{Constants.mono2micro_codebases_root}/fenixedu-academic_all/datafile.json", "r") as f:
-        data_collection = json.load(f)
+    traces = load_traces(f"{Constants.mono2micro_codebases_root}/fenixedu-academic_all/datafile.json")
 
     decomposition = init_decomposition(clusters)
     decomposition.controllers, decomposition.accesses_controllers = get_controllers_with_costly_accesses(
-        "fenixedu-academic_all", decomposition.entity_id_to_cluster_id, data_collection)
+        "fenixedu-academic_all", decomposition.entity_id_to_cluster_id, traces)
 
-    complexity = decomposition.compute_complexity(data_collection)
+    complexity = decomposition.compute_complexity(traces)
     print(f"Final Complexity: {complexity}")
 
 
@@ -8,6 +8,7 @@ import pandas as pd
 from funcy import log_durations, print_durations
 
 from helpers.constants import Constants
+from helpers.traces import load_traces
 
 from rich import print
 
@@ -82,10 +83,7 @@ class StaticCollection:
         self.path = path
         self.controllers = []
 
-        with open(path, "r") as f:
-            data_collection = json.load(f)
-        for controller, trace in data_collection.items():
-            accesses = trace["t"][0]["a"]
+        for controller, accesses in load_traces(path).items():
             self.controllers.append(Controller(controller, accesses))
 
     def controllers_reading(self, entities):
@@ -2,10 +2,10 @@ import json
 import time
 from collections import defaultdict
 
-import pandas as pd
 from funcy import print_durations
 
 from helpers.constants import Constants
+from helpers.traces import load_traces
 from metrics.complexity import Controller, add_access_to_accesses_controllers, init_decomposition, \
     get_controllers_to_clusters
 
@@ -14,15 +14,9 @@ def load_raw_data(codebase_name, cut_name):
     with open(f"{Constants.mono2micro_codebases_root}/{codebase_name}/analyser/cuts/"
               f"{cut_name}", "r") as f:
         clusters = json.load(f)["clusters"]
-    with open(f"{Constants.mono2micro_codebases_root}/{codebase_name}/datafile.json", "r") as f:
-        data_collection = json.load(f)
+    traces = load_traces(f"{Constants.mono2micro_codebases_root}/{codebase_name}/datafile.json")
 
-    return clusters, data_collection
-
-
-def iter_data_collection(data_collection):
-    for controller in data_collection:
-        yield controller, data_collection[controller]["t"][0]["a"]
+    return clusters, traces
 
 
 def controllers_costly_accesses(entity_id_to_cluster_id, controller_data):
@@ -85,12 +79,13 @@ def compute_complexity(decomposition, controller_data):
         local_transaction_set = get_local_transactions_set(controller, group, decomposition)
         all_local_transactions_sets[controller] = local_transaction_set
 
-    controllers_clusters_map = get_controllers_to_clusters(decomposition.clusters, decomposition.controllers.values())
+    controllers_clusters_map, clusters_counts = get_controllers_to_clusters(decomposition,
+                                                                           decomposition.controllers.values())
+    decomposition.index_costly_accesses(clusters_counts)
     for controller in decomposition.controllers.keys():
-        if len(controllers_clusters_map[decomposition.controllers[controller]]) == 1:
+        if clusters_counts[decomposition.controllers[controller]] == 1:
             continue
-        complexity += decomposition.get_controller_complexity(all_local_transactions_sets[controller], controller,
-                                                     controllers_clusters_map)
+        complexity += decomposition.get_controller_complexity(all_local_transactions_sets[controller], controller)
 
         # for transaction in all_local_transactions_sets[controller]:
         #     # Find next local transactions, add cluster dependencies
@@ -153,15 +148,11 @@ def get_local_transactions_set(controller, accesses, decomposition):
 
 
 def main():
-    clusters, data_collection = load_raw_data("fenixedu-academic_all", "20,10,0,10,60,0,5.json")
-    controller_data = []
-    for controller, accesses in iter_data_collection(data_collection):
-        for access in accesses:
-            controller_data.append((controller, access[1], access[0]))
+    clusters, traces = load_raw_data("fenixedu-academic_all", "20,10,0,10,60,0,5.json")
 
     decomposition = init_decomposition(clusters)
 
-    controller_data = pd.DataFrame(controller_data, columns=["name", "entity_id", "mode"])
+    controller_data = traces.to_dataframe()
     cols = ["name", "entity_id", "mode"]
     controller_data = controller_data[cols].loc[(controller_data[cols].shift() != controller_data[cols]).any(axis=1)]
 
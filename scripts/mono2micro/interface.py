@@ -7,6 +7,7 @@ from rich import print
 import requests
 from distutils.dir_util import copy_tree
 
+from collector.service import export_expanded_coupling
 from helpers.constants import Constants
 
 
@@ -19,15 +20,21 @@ class Mono2MicroRequests:
         self.commit_analyser_url = self.base_url + "/codebase/{}/commitAnalyser"
         self.create_dendrogram_url = self.base_url + "/codebase/{}/dendrogram/create"
 
-    def do_create_codebase(self, codebase_name, codebase_suffix):
+    def do_create_codebase(self, codebase_name, codebase_suffix, commit_interval=None, expanded_commits=False):
         data = {
             'codebaseName': codebase_name + codebase_suffix
         }
         codebases_path = Constants.codebases_data_output_directory
+        # Commit files of other intervals are written side by side by collect_data, as <codebase>_commit_<interval>
+        commit_suffix = f"_{commit_interval}" if commit_interval is not None else ""
+        if expanded_commits:
+            commit_file = export_expanded_coupling(codebase_name, commit_suffix)
+        else:
+            commit_file = f"{codebases_path}/{codebase_name}/{codebase_name}_commit{commit_suffix}.json"
         files = {
             'datafile': open(f"{codebases_path}/{codebase_name}/{codebase_name}.json"),
             'translationFile': open(f"{codebases_path}/{codebase_name}/{codebase_name}_IDToEntity.json"),
-            'commitFile': open(f"{codebases_path}/{codebase_name}/{codebase_name}_commit.json"),
+            'commitFile': open(commit_file),
             'authorFile': open(f"{codebases_path}/{codebase_name}/{codebase_name}_author.json")
         }
         r = requests.post(self.create_codebase_url, files=files, data=data)
@@ -89,7 +96,7 @@ class Mono2MicroRequests:
         return r.status_code
 
 
-def create_codebases(codebases, suffix):
+def create_codebases(codebases, suffix, commit_interval=None, expanded_commits=False):
     mono2micro = Mono2MicroRequests()
 
     for i, codebase_data in enumerate(codebases):
@@ -98,7 +105,7 @@ def create_codebases(codebases, suffix):
         print(f"[underline]{codebase}[/underline] [{i + 1}/{len(codebases)}]")
 
         print(":white_circle: Creating codebase... ", end="")
-        all_files_result = mono2micro.do_create_codebase(codebase, suffix)
+        all_files_result = mono2micro.do_create_codebase(codebase, suffix, commit_interval, expanded_commits)
         if all_files_result == 201:
             print("[green]Success.[/green]")
         else:
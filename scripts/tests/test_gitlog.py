@@ -0,0 +1,72 @@
+import random
+import subprocess
+
+import pytest
+
+from collector.gitlog import read_history
+from collector.history import History
+
+
+def file_contents(rng, lines=30):
+    return "".join(f"    int field{rng.randrange(10 ** 9)} = {rng.randrange(10 ** 9)};\n" for _ in range(lines))
+
+
+def fast_import_stream(seed, commits=120, large_commit_rate=0.1, large_commit_files=40):
+    """
+    Commits of a repository whose files all have different contents, so every rename has a single best match. Renamed
+    files are also edited, so git has to detect them by similarity. Some commits are large refactors, with renames,
+    deletions and changes to files that are not Java.
+    """
+    rng = random.Random(seed)
+    files, next_file = {}, 0
+    for commit in range(commits):
+        yield f"commit refs/heads/master\ncommitter Author <author{rng.randrange(5)}@example.com> " \
+              f"{1500000000 + 3600 * commit} +0000\ndata 0\n"
+        large = commit > 10 and rng.random() < large_commit_rate
+        for _ in range(large_commit_files if large else rng.randint(1, 6)):
+            change = rng.random()
+            java_files = [filename for filename in files if filename.endswith(".java")]
+            if java_files and change < 0.1:
+                filename = rng.choice(java_files)
+                del files[filename]
+                yield f"D {filename}\n"
+                continue
+            if java_files and change < (0.4 if large else 0.2):
+                previous_filename = rng.choice(java_files)
+                filename = f"src/package{next_file % 7}/Class{next_file}.java"
+                next_file += 1
+                files[filename] = files.pop(previous_filename) + "    // moved\n"
+                yield f"R {previous_filename} {filename}\n"
+            elif not files or change < 0.6:
+                java = rng.random() >= 0.2
+                filename = f"src/package{next_file % 7}/Class{next_file}.java" if java else f"docs/file{next_file}.txt"
+                next_file += 1
+                files[filename] = file_contents(rng)
+            else:
+                filename = rng.choice(list(files))
+                files[filename] += f"    // {commit}\n"
+            yield f"M 100644 inline {filename}\ndata {len(files[filename])}\n{files[filename]}\n"
+
+
+@pytest.fixture(scope="module", params=[0, 1, 2])
+def repository_path(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp(f"repository{request.param}")
+    subprocess.run(["git", "init", "--quiet", str(path)], check=True)
+    subprocess.run(["git", "-C", str(path), "fast-import", "--quiet"], check=True, encoding="utf-8",
+                   input="".join(fast_import_stream(request.param)))
+    subprocess.run(["git", "-C", str(path), "checkout", "--quiet", "master"], check=True)
+    return path
+
+
+def cleaned_history_df(history_df, cutoff_value):
+    history = History("test", history_df).fix_renames().fix_deletes().get_no_refactors_copy(cutoff_value)
+    return history.history_df.astype(object).reset_index(drop=True)
+
+
+@pytest.mark.parametrize("cutoff_value", [5, 10, 20])
+def test_two_pass_read_gives_the_cleaned_history_of_a_full_read(repository_path, cutoff_value):
+    full = read_history(repository_path)
+    two_pass = read_history(repository_path, large_commit_files=cutoff_value)
+
+    assert list(full['commit_hash'].astype(object).unique()) == list(two_pass['commit_hash'].astype(object).unique())
+    assert cleaned_history_df(full, cutoff_value).equals(cleaned_history_df(two_pass, cutoff_value))
@@ -0,0 +1,85 @@
+import random
+
+import pandas as pd
+import pytest
+
+from collector.gitlog import intern_history
+from collector.history import History, resolve_renames
+
+
+def renamed_filenames_by_loop(renames, filenames):
+    """
+    The filenames after the renames, rewritten one rename at a time like `History.fix_renames` used to do.
+    """
+    filenames = list(filenames)
+    for before, after in renames:
+        filenames = [after if filename == before else filename for filename in filenames]
+    return filenames
+
+
+def history_with_renames(renames, other_filenames=()):
+    """
+    History with a commit per rename, in order, and then a modification of each of `other_filenames`.
+    """
+    rows = [("RENAMED", before, after) for before, after in renames]
+    rows += [("MODIFIED", " ", filename) for filename in other_filenames]
+    history_df = pd.DataFrame({
+        'commit_hash': [f"c{i}" for i in range(len(rows))],
+        'change_type': [row[0] for row in rows],
+        'previous_filename': [row[1] for row in rows],
+        'filename': [row[2] for row in rows],
+        'timestamp': list(range(len(rows))),
+        'author': ["author@example.com"] * len(rows),
+    })
+    return History("test", intern_history(history_df))
+
+
+CASES = {
+    "chain": [("A", "B"), ("B", "C"), ("C", "D")],
+    "reused name": [("A", "B"), ("C", "A"), ("A", "E")],
+    "cycle": [("A", "B"), ("B", "A")],
+    "cycle and back": [("A", "B"), ("B", "A"), ("A", "B")],
+    "swap": [("A", "T"), ("B", "A"), ("T", "B")],
+    "merge into existing": [("A", "B"), ("C", "B"), ("B", "D")],
+    "rename to itself": [("A", "A"), ("A", "B")],
+}
+
+
+def random_renames(seed, count=200, names=30):
+    rng = random.Random(seed)
+    return [(f"F{rng.randrange(names)}", f"F{rng.randrange(names)}") for _ in range(count)]
+
+
+@pytest.mark.parametrize("renames", [*CASES.values(), *(random_renames(seed) for seed in range(20))],
+                         ids=[*CASES, *(f"random {seed}" for seed in range(20))])
+def test_resolve_renames_matches_loop(renames):
+    names = sorted({name for rename in renames for name in rename})
+    final_names = resolve_renames(renames)
+    assert [final_names.get(name, name) for name in names] == renamed_filenames_by_loop(renames, names)
+
+
+@pytest.mark.parametrize("renames", [*CASES.values(), *(random_renames(seed) for seed in range(5))],
+                         ids=[*CASES, *(f"random {seed}" for seed in range(5))])
+def test_fix_renames_matches_loop(renames):
+    other_filenames = ["A", "B", "C", "Unrelated"]
+    history = history_with_renames(renames, other_filenames)
+    expected = renamed_filenames_by_loop(renames, [after for _, after in renames] + other_filenames)
+    assert history.fix_renames().history_df['filename'].astype(object).tolist() == expected
+
+
+def test_commits_follow_history_order_whatever_the_categories():
+    history_df = history_with_renames([("A", "B")], ["B", "C", "D"]).history_df
+    history_df = history_df.assign(commit_hash=pd.Categorical(["c9", "c1", "c1", "c5"]))
+    reordered_df = history_df.assign(commit_hash=history_df['commit_hash'].cat.reorder_categories(["c9", "c5", "c1"]))
+
+    for df in (history_df, reordered_df):
+        history = History("test", df)
+        commits = [(commit_hash, [history.history_df['filename'].cat.categories[code] for code in files])
+                   for commit_hash, files in history.commits()]
+        assert commits == [("c9", ["B"]), ("c1", ["B", "C"]), ("c5", ["D"])]
+
+
+def test_short_filenames_resolve_to_files_with_the_collected_extension():
+    history = history_with_renames([("a/Foo.java", "a/Foo.txt")], ["a/Foo.txt", "b/Foo.java"]).fix_renames()
+    assert history.history_df['filename'].astype(object).tolist()[0] == "a/Foo.txt"
+    assert history.convert_short_to_long_filename("Foo") == "b/Foo.java"